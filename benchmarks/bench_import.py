@@ -0,0 +1,69 @@
+"""
+Measure the cold start cost of importing the package.
+
+Every scenario runs in a fresh interpreter without WHATSAPP_* variables, so the
+numbers include everything a new worker pays before it can handle a request:
+
+- whatsapp: `import whatsapp`
+- client: importing and opening a WhatsAppClient (loads httpx)
+- app: `import main`, the FastAPI app including its routes
+
+Run from the repository root with `python -m benchmarks.bench_import`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    "whatsapp": "import whatsapp",
+    "client": "import whatsapp\nwhatsapp.WhatsAppClient('token', '123').client",
+    "app": "import main",
+}
+
+
+def run(code: str, env: dict) -> tuple[float, list[tuple[int, str]]]:
+    """Run `code` with -X importtime and return the wall time and the imports."""
+    timed = f"import time\nstart = time.perf_counter()\n{code}\n"
+    timed += "print(time.perf_counter() - start)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", timed],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append((int(parts[1]), parts[2].rstrip()))
+    return float(result.stdout.split()[-1]), imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    env = {k: v for k, v in os.environ.items() if not k.startswith("WHATSAPP_")}
+    env["PYTHONPATH"] = os.getcwd()
+    for name in args.scenarios:
+        runs = [run(SCENARIOS[name], env) for _ in range(args.repeat)]
+        times = sorted(t for t, _ in runs)
+        print(
+            f"{name:<10} median {statistics.median(times) * 1e3:7.1f} ms"
+            f"   min {times[0] * 1e3:7.1f} ms"
+        )
+        # top-level imports only, nested ones are included in their parent
+        imports = [(us, mod) for us, mod in runs[-1][1] if not mod.startswith("  ")]
+        for us, mod in sorted(imports, reverse=True)[: args.top]:
+            print(f"{'':<10} {us / 1e3:7.1f} ms {mod.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure the memory held per parsed message.
+
+- before: plain dataclasses with a per-instance __dict__ and no interning, as
+  WamBase, WamMediaType and WamStatus were defined originally
+- after: the current slotted dataclasses with interned repeated fields
+
+The raw payload is decoded for each run and dropped afterwards, so only the
+memory retained by the parsed objects is counted.
+
+Run from the repository root with `python -m benchmarks.bench_memory`.
+"""
+
+import argparse
+import gc
+import tracemalloc
+from dataclasses import dataclass, field
+from unittest import mock
+
+import whatsapp as wa
+from benchmarks.payloads import encode, synthetic_batch
+
+
+@dataclass
+class LegacyWamBase:
+    webhook_id: str
+    wamid: str
+    phone_number_id: str
+    wa_id: str
+    profile_name: str
+    message_type: str
+    timestamp: str
+    message_body: str = field(default="", kw_only=True)
+    reference_wamid: str | None = field(default=None, kw_only=True)
+    reference_message_user_phone: str | None = field(default=None, kw_only=True)
+
+
+@dataclass
+class LegacyWamMediaType(LegacyWamBase):
+    mime_type: str
+    media_id: str
+    media_bytes: bytes = field(default=b"")
+    sha256: str = field(default="")
+
+
+@dataclass
+class LegacyWamStatus:
+    webhook_id: str
+    wamid: str
+    phone_number_id: str
+    recipient_id: str
+    status: str
+    timestamp: str
+
+
+def retained_bytes(raw: bytes) -> tuple[int, int]:
+    """Return the bytes retained by the parsed events and the number of events."""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    events = wa.parse_webhook_body(raw)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, len(events)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=10_000)
+    args = parser.parse_args()
+
+    raw = encode(synthetic_batch(args.messages))
+
+    with mock.patch.multiple(
+        wa,
+        WamBase=LegacyWamBase,
+        WamMediaType=LegacyWamMediaType,
+        WamStatus=LegacyWamStatus,
+    ):
+        before, n = retained_bytes(raw)
+    after, _ = retained_bytes(raw)
+
+    print(f"{n} events ({args.messages} messages and their statuses)")
+    print(f"{'':<8}{'total KiB':>12}{'bytes/event':>14}")
+    print(f"{'before':<8}{before / 1024:>12.0f}{before / n:>14.0f}")
+    print(f"{'after':<8}{after / 1024:>12.0f}{after / n:>14.0f}")
+    print(f"saved {1 - after / before:.0%}")
+
+
+if __name__ == "__main__":
+    main()
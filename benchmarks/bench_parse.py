@@ -0,0 +1,55 @@
+"""
+Compare webhook parsing paths.
+
+- pydantic: validate the body into WebhookRequestData, then `iter_webhook_events`
+  (what `process_webhook_data` does)
+- fast: `parse_webhook_body` on the raw bytes
+
+Run from the repository root with `python -m benchmarks.bench_parse`.
+"""
+
+import argparse
+import timeit
+
+import whatsapp as wa
+from benchmarks.payloads import encode, fixture_payloads, synthetic_batch
+
+
+def pydantic_path(raw: bytes) -> list:
+    body = wa.WebhookRequestData.model_validate_json(raw)
+    return list(wa.iter_webhook_events(body))
+
+
+def fast_path(raw: bytes) -> list:
+    return wa.parse_webhook_body(raw)
+
+
+def bench(raw: bytes, repeat: int) -> tuple[float, float]:
+    assert pydantic_path(raw) == fast_path(raw)
+    results = []
+    for fn in (pydantic_path, fast_path):
+        n, _ = timeit.Timer(lambda: fn(raw)).autorange()
+        best = min(timeit.repeat(lambda: fn(raw), number=n, repeat=repeat))
+        results.append(best / n * 1e6)
+    return results[0], results[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    cases = {name: encode(p) for name, p in fixture_payloads().items()}
+    for n in args.batch_sizes:
+        cases[f"synthetic_{n}_messages"] = encode(synthetic_batch(n))
+
+    print(f"json decoder: {wa._json_loads.__module__}")
+    print(f"{'payload':<32}{'pydantic µs':>14}{'fast µs':>12}{'speedup':>10}")
+    for name, raw in cases.items():
+        slow, fast = bench(raw, args.repeat)
+        print(f"{name:<32}{slow:>14.1f}{fast:>12.1f}{slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
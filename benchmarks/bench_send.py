@@ -0,0 +1,119 @@
+"""
+Measure the Graph API paths of WhatsAppClient against the fake Graph API.
+
+- send: `send_message` from many concurrent tasks
+- download: `stream_media` of the same media from many tasks
+- upload: `upload_media` of distinct files
+
+The fake runs in-process over httpx.ASGITransport, so the numbers cover the
+client's own overhead (retries, limiters, caches) plus the injected latency,
+without network noise. Use --throttle-rate and --error-rate to see how the
+retry policy and the adaptive limiter cope.
+
+Run from the repository root with `python -m benchmarks.bench_send`.
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import httpx
+
+import whatsapp as wa
+from benchmarks.fake_graph import FaultConfig, create_app
+from benchmarks.report import latency_summary, print_report
+
+
+async def timed_calls(calls, concurrency: int) -> tuple[list[float], int, float]:
+    """Run the coroutine functions with bounded concurrency and time each one."""
+    latencies: list[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    return latencies, failures, time.perf_counter() - start
+
+
+async def bench(args: argparse.Namespace) -> None:
+    config = FaultConfig(
+        latency=args.latency,
+        jitter=args.latency / 2,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        media_size=args.media_size,
+    )
+    fake = create_app(config)
+    client = wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        base_url="http://graph.test",
+        transport=httpx.ASGITransport(app=fake),
+        retry_policy=wa.RetryPolicy(base_delay=0.01, max_delay=0.1),
+    )
+
+    scenarios = {
+        "send": [
+            lambda i=i: client.send_message(f"4917{i:08d}", "hello")
+            for i in range(args.messages)
+        ],
+        "download": [
+            lambda: consume(client.stream_media("media-1"))
+            for _ in range(args.downloads)
+        ],
+        "upload": [
+            lambda i=i: client.upload_media(
+                i.to_bytes(8, "big") * 1024, f"{i}.pdf", "application/pdf"
+            )
+            for i in range(args.uploads)
+        ],
+    }
+    async with client:
+        for name in args.scenarios:
+            tracemalloc.start()
+            latencies, failures, elapsed = await timed_calls(
+                scenarios[name], args.concurrency
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows: dict = latency_summary(latencies, elapsed)
+            rows["failures"] = failures
+            rows["peak_traced_mb"] = peak / 2**20
+            print_report(f"{name} (concurrency {args.concurrency})", rows)
+    print_report("fake graph responses", dict(sorted(fake.state.stats.items())))
+
+
+async def consume(chunks) -> None:
+    async for _ in chunks:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--downloads", type=int, default=200)
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--media-size", type=int, default=256 * 1024)
+    parser.add_argument("scenarios", nargs="*", default=["send", "download", "upload"])
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
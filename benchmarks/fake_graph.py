@@ -0,0 +1,144 @@
+"""
+A local stand-in for the Graph API with latency, error and throttling injection.
+
+Serves what WhatsAppClient talks to:
+
+- POST /{version}/{phone_number_id}/messages
+- POST /{version}/{phone_number_id}/media
+- GET /{version}/{media_id}, the media URL lookup
+- GET /download/{media_id}, the media download
+- GET /stats, the number of requests served per endpoint and outcome
+
+Run it with `python -m benchmarks.fake_graph --port 9000` and point the app at it
+with WHATSAPP_GRAPH_URL=http://127.0.0.1:9000. In-process benchmarks can mount
+`create_app()` with httpx.ASGITransport instead.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import random
+from collections import Counter
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FaultConfig:
+    """
+    How the fake Graph API misbehaves.
+
+    Args:
+        latency (float): Mean response time in seconds.
+        jitter (float): Maximum deviation from the mean latency in seconds.
+        error_rate (float): Fraction of requests failing with a 500.
+        throttle_rate (float): Fraction of requests rejected with a 429 and the
+            Graph error code 130429.
+        media_size (int): Size of the downloaded media in bytes.
+    """
+
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    media_size: int = 256 * 1024
+
+
+def create_app(config: FaultConfig | None = None) -> FastAPI:
+    """Create the fake Graph API app. Its counters are in `app.state.stats`."""
+    config = config or FaultConfig()
+    app = FastAPI()
+    app.state.config = config
+    app.state.stats = stats = Counter()
+    ids = itertools.count()
+    media = random.randbytes(config.media_size)
+    media_sha256 = base64.b64encode(hashlib.sha256(media).digest()).decode()
+
+    async def inject(endpoint: str) -> Response | None:
+        """Wait for the simulated latency and return an injected failure, if any."""
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        await asyncio.sleep(max(0.0, delay))
+        roll = random.random()
+        if roll < config.throttle_rate:
+            stats[f"{endpoint}.429"] += 1
+            error = {"code": 130429, "message": "Rate limit hit"}
+            return JSONResponse({"error": error}, 429, headers={"Retry-After": "1"})
+        if roll < config.throttle_rate + config.error_rate:
+            stats[f"{endpoint}.500"] += 1
+            return JSONResponse({"error": {"code": 1, "message": "Unknown"}}, 500)
+        stats[f"{endpoint}.200"] += 1
+        return None
+
+    @app.post("/{version}/{phone_number_id}/messages")
+    async def messages(request: Request):
+        if failure := await inject("messages"):
+            return failure
+        to = (await request.json())["to"]
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": to, "wa_id": to}],
+            "messages": [{"id": f"wamid.fake-{next(ids)}"}],
+        }
+
+    @app.post("/{version}/{phone_number_id}/media")
+    async def upload(request: Request):
+        await request.body()
+        if failure := await inject("media"):
+            return failure
+        return {"id": f"media-{next(ids)}"}
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    @app.get("/download/{media_id}")
+    async def download(media_id: str):
+        if failure := await inject("download"):
+            return failure
+        return Response(media, media_type="image/jpeg")
+
+    @app.get("/{version}/{media_id}")
+    async def media_info(media_id: str, request: Request):
+        if failure := await inject("media_info"):
+            return failure
+        return {
+            "id": media_id,
+            "url": str(request.url_for("download", media_id=media_id)),
+            "mime_type": "image/jpeg",
+            "sha256": media_sha256,
+            "file_size": len(media),
+            "messaging_product": "whatsapp",
+        }
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--media-size", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    config = FaultConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        media_size=args.media_size,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
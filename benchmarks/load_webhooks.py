@@ -0,0 +1,157 @@
+"""
+Replay webhook payloads against the app at a fixed request rate.
+
+Requests are sent open-loop, on a fixed schedule regardless of how fast the app
+answers, and latency is measured from the scheduled send time, so a stalling
+app shows up as latency instead of silently lowering the request rate. Every
+replayed message gets a fresh wamid so the app's deduplication does not skip it,
+and senders are rotated so the load spreads over many conversations.
+
+Typical setup, in three shells:
+
+    python -m benchmarks.fake_graph --port 9000
+    WHATSAPP_GRAPH_URL=http://127.0.0.1:9000 WHATSAPP_APP_SECRET=bench \
+        uvicorn main:app --port 8000
+    python -m benchmarks.load_webhooks --rps 200 --duration 30 --app-secret bench \
+        --graph-stats http://127.0.0.1:9000/stats --server-pid <uvicorn pid>
+
+Payloads default to the captured test fixtures. Pass `--payloads file.jsonl`
+to replay webhook bodies captured from production, one JSON body per line.
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import hmac
+import itertools
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from benchmarks.payloads import fixture_payloads
+from benchmarks.report import latency_summary, print_report, process_rss_mb
+
+
+def load_payloads(path: str | None) -> list[dict]:
+    """Return the webhook bodies from a JSONL file or, by default, the fixtures."""
+    if path is None:
+        return list(fixture_payloads().values())
+    lines = Path(path).read_text().splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def replay_bodies(payloads: list[dict], n: int, senders: int = 1000) -> list[bytes]:
+    """Encode `n` bodies cycling through the payloads, with unique wamids."""
+    bodies = []
+    for i, payload in zip(range(n), itertools.cycle(payloads)):
+        body = copy.deepcopy(payload)
+        sender = f"4900{i % senders:08d}"
+        for entry in body.get("entry", []):
+            for change in entry.get("changes", []):
+                value = change.get("value", {})
+                for contact in value.get("contacts", []):
+                    contact["wa_id"] = sender
+                for message in value.get("messages", []):
+                    message["from"] = sender
+                for item in value.get("messages", []) + value.get("statuses", []):
+                    item["id"] = f"{item['id']}.replay-{i}"
+        bodies.append(json.dumps(body).encode())
+    return bodies
+
+
+async def run_load(
+    url: str,
+    bodies: list[bytes],
+    rps: float,
+    app_secret: str | None = None,
+    timeout: float = 30,
+) -> tuple[list[float], Counter, float]:
+    """
+    Post the bodies to `url` at `rps` requests per second.
+
+    Returns:
+        tuple[list[float], Counter, float]: The latencies of the successful requests
+            in seconds, the number of responses per status, and the elapsed time.
+    """
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+
+    async def post(client: httpx.AsyncClient, body: bytes, scheduled: float) -> None:
+        headers = {"Content-Type": "application/json"}
+        if app_secret:
+            digest = hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Hub-Signature-256"] = f"sha256={digest}"
+        try:
+            response = await client.post(url, content=body, headers=headers)
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            return
+        statuses[response.status_code] += 1
+        if response.is_success:
+            latencies.append(time.perf_counter() - scheduled)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        for i, body in enumerate(bodies):
+            scheduled = start + i / rps
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            tasks.append(asyncio.create_task(post(client, body, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+async def graph_stats(url: str | None) -> dict[str, int]:
+    if url is None:
+        return {}
+    async with httpx.AsyncClient() as client:
+        return (await client.get(url)).json()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/whatsapp")
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--payloads", help="JSONL file of webhook bodies")
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--app-secret", help="sign requests like Meta does")
+    parser.add_argument("--graph-stats", help="URL of the fake Graph API /stats")
+    parser.add_argument("--server-pid", type=int, help="report the app's memory")
+    parser.add_argument(
+        "--drain", type=float, default=2, help="seconds to wait for replies"
+    )
+    args = parser.parse_args()
+
+    n = int(args.rps * args.duration)
+    bodies = replay_bodies(load_payloads(args.payloads), n, args.senders)
+    before = await graph_stats(args.graph_stats)
+    latencies, statuses, elapsed = await run_load(
+        args.url, bodies, args.rps, app_secret=args.app_secret
+    )
+    await asyncio.sleep(args.drain)
+    after = await graph_stats(args.graph_stats)
+
+    rows: dict = latency_summary(latencies, elapsed)
+    rows["target_rps"] = args.rps
+    responses = sorted((str(k), v) for k, v in statuses.items())
+    rows["responses"] = ", ".join(f"{k}: {v}" for k, v in responses)
+    if args.graph_stats:
+        sent = after.get("messages.200", 0) - before.get("messages.200", 0)
+        rows["replies_sent"] = sent
+        rows["reply_throughput"] = sent / (elapsed + args.drain)
+        throttled = after.get("messages.429", 0) - before.get("messages.429", 0)
+        rows["replies_throttled"] = throttled
+    if args.server_pid:
+        rows["server_rss_mb"] = process_rss_mb(args.server_pid)
+    print_report(f"webhook load against {args.url}", rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
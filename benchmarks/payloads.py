@@ -0,0 +1,76 @@
+"""
+Webhook payloads shared by the benchmarks.
+
+The captured payloads are taken from the fixtures in tests/conftest.py, the
+synthetic ones scale them up to the batch sizes Meta sends under load.
+"""
+
+import copy
+import json
+
+from tests import conftest
+
+FIXTURES = [
+    "example_text_message",
+    "example_text_reply",
+    "example_voice_message",
+    "example_image_message",
+    "example_batched_messages",
+    "example_button_reply",
+]
+
+
+def fixture_payloads() -> dict[str, dict]:
+    """Return the webhook payloads of the test fixtures by fixture name."""
+    payloads = {}
+    for name in FIXTURES:
+        # pytest refuses direct fixture calls, call the wrapped function instead
+        fixture = getattr(conftest, name).__pytest_wrapped__.obj
+        payloads[name] = fixture().model_dump(mode="json")
+    return payloads
+
+
+def synthetic_batch(n_messages: int, statuses_per_message: int = 3) -> dict:
+    """
+    Build a single webhook payload carrying `n_messages` text and image messages
+    and `statuses_per_message` status updates per message.
+    """
+    base = fixture_payloads()
+    text = base["example_text_message"]["entry"][0]["changes"][0]["value"]
+    image = base["example_image_message"]["entry"][0]["changes"][0]["value"]
+    status = base["example_batched_messages"]["entry"][0]["changes"][1]["value"]
+
+    messages, statuses = [], []
+    for i in range(n_messages):
+        message = copy.deepcopy((image if i % 4 == 0 else text)["messages"][0])
+        message["id"] = f"wamid.synthetic-{i}"
+        message["from"] = text["contacts"][0]["wa_id"]
+        messages.append(message)
+        for state in ["sent", "delivered", "read"][:statuses_per_message]:
+            s = copy.deepcopy(status["statuses"][0])
+            s["id"] = f"wamid.outbound-{i}"
+            s["status"] = state
+            statuses.append(s)
+
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "206144975918077",
+                "changes": [
+                    {
+                        "value": {**text, "messages": messages},
+                        "field": "messages",
+                    },
+                    {
+                        "value": {**status, "statuses": statuses},
+                        "field": "messages",
+                    },
+                ],
+            }
+        ],
+    }
+
+
+def encode(payload: dict) -> bytes:
+    return json.dumps(payload).encode()
@@ -0,0 +1,55 @@
+"""
+Latency, throughput and memory summaries shared by the load benchmarks.
+"""
+
+import resource
+import sys
+from pathlib import Path
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of already sorted values."""
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, round(q / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def latency_summary(latencies: list[float], elapsed: float) -> dict[str, float]:
+    """Summarize latencies in seconds of requests completed within `elapsed` seconds."""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50) * 1e3,
+        "p90_ms": percentile(values, 90) * 1e3,
+        "p99_ms": percentile(values, 99) * 1e3,
+        "max_ms": (values[-1] if values else float("nan")) * 1e3,
+    }
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident memory of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def process_rss_mb(pid: int) -> float | None:
+    """Return the current resident memory of another process in MiB, Linux only."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) / 2**10
+    return None
+
+
+def print_report(title: str, rows: dict[str, float | int | str | None]) -> None:
+    print(title)
+    for name, value in rows.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"  {name:<24}{value}")
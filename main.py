@@ -1,24 +1,159 @@
+import collections
+import functools
 import json
 import logging
+import os
+from contextlib import asynccontextmanager
 
-import uvicorn
-from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, Request
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
 
 import whatsapp as wa
 
-load_dotenv()  # needs to happen before cfg is loaded
+settings = wa.get_settings()  # loads .env, needs to happen before cfg is read
 
 
-logging.basicConfig(
-    filename="example.log",
-    level=logging.DEBUG,
-    format="%(asctime)s %(levelname)s:%(message)s",
+# JSON logs are written on a background thread, high-volume categories are capped
+log_listener = wa.configure_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    filename=os.environ.get("LOG_FILE", "example.log"),
+    sample_rates={"status": float(os.environ.get("LOG_STATUS_SAMPLE_RATE", 0.1))},
+    # httpx logs every request at INFO
+    rate_limits={
+        "status": 10,
+        "retry": 10,
+        "parse": 10,
+        "queue": 1,
+        "webhook": 1,
+        "httpx": 10,
+    },
+    secrets=[settings.token, settings.app_secret, settings.verify_token],
 )
 
+
+# served in the Prometheus format at /metrics, set METRICS_ENABLED=0 to turn off
+metrics = wa.Metrics(
+    enabled=os.environ.get("METRICS_ENABLED", "1") != "0",
+    tracing=os.environ.get("OTEL_TRACING", "0") != "0",
+)
+wa.set_metrics(metrics)
+
+
+def log_statuses(statuses: list[wa.WamStatus]) -> None:
+    counts = collections.Counter(s.status for s in statuses)
+    logging.info(
+        f"Received WhatsApp status updates: {dict(counts)}",
+        extra={"category": "status"},
+    )
+
+
+# status updates are coalesced per message and handled in batches
+status_aggregator = wa.StatusAggregator(wa.CallbackSink(log_statuses))
+
+
+# serve several business numbers, replies are sent from the number that was messaged
+if tenants_file := os.environ.get("WHATSAPP_TENANTS_FILE"):
+    wa.set_tenants(wa.TenantRegistry.from_file(tenants_file))
+
+
+router = wa.Router()
+
+
+@router.on_status()
+async def collect_status(status: wa.WamStatus) -> None:
+    await status_aggregator.add(status)
+
+
+@router.on_media()
+async def reply_to_media(wam: wa.WamMediaType) -> None:
+    await wa.send_message(
+        recipient_id=wam.wa_id,
+        message=f"Mmm, {wam.message_type}",
+        phone_number_id=wam.phone_number_id,
+    )
+
+
+@router.on_text()
+async def echo_text(wam: wa.WamBase) -> None:
+    await wa.send_message(
+        recipient_id=wam.wa_id,
+        message=wam.message_body,
+        phone_number_id=wam.phone_number_id,
+    )
+
+
+# Meta redelivers webhooks we were slow to acknowledge, skip what we already handled
+dedup_store = wa.InMemoryDedupStore()
+
+
+# events of one conversation are handled in order, conversations run in parallel
+conversations = wa.KeyedScheduler(
+    workers=int(os.environ.get("CONVERSATION_WORKERS", 32))
+)
+
+
+async def process_webhook(wams: list[wa.WamBase | wa.WamStatus]) -> None:
+    for wam in await wa.drop_duplicates(wams, dedup_store):
+        try:
+            conversations.submit(
+                wa.conversation_key(wam), functools.partial(router.dispatch, wam)
+            )
+        except wa.QueueFullError:
+            logging.warning(
+                f"Dropped {wam.wamid}, its conversation is backlogged.",
+                extra={"category": "queue"},
+            )
+
+
+work_queue = wa.WorkQueue(
+    process_webhook,
+    workers=int(os.environ.get("WEBHOOK_WORKERS", 8)),
+    maxsize=int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000)),
+)
+
+metrics.gauge("whatsapp_webhook_queue_depth", lambda: work_queue.stats()["depth"])
+metrics.gauge(
+    "whatsapp_conversations_pending", lambda: conversations.stats()["pending"]
+)
+metrics.gauge("whatsapp_statuses_pending", lambda: status_aggregator.pending)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener.start()
+    config = wa.get_settings()
+    if not config.verify_signatures:
+        logging.warning("Webhook signatures are not verified.")
+    elif config.app_secret is None:
+        logging.error("WHATSAPP_APP_SECRET is not set, all webhooks will be rejected.")
+    # open the pooled Graph API clients once and close them on shutdown
+    tenants = await wa.get_tenants().start()
+    clients = list(tenants)
+    # the default number is optional when all numbers come from the tenants file,
+    # without either get_client raises a ConfigurationError
+    client = None
+    if config.token or not tenants:
+        client = await wa.get_client().start()
+        clients.append(client)
+    for tenant in clients:
+        metrics.track_client(tenant)
+    await conversations.start()
+    await work_queue.start()
+    await status_aggregator.start()
+    yield
+    # finish the accepted webhooks before the client goes away
+    shutdown_timeout = float(os.environ.get("SHUTDOWN_TIMEOUT", 30))
+    await work_queue.stop(timeout=shutdown_timeout)
+    await conversations.stop(timeout=shutdown_timeout)
+    await status_aggregator.stop()
+    if client is not None:
+        await client.aclose()
+    await tenants.aclose()
+    log_listener.stop()
+
+
 # Init App.
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 @app.router.get("/api/whatsapp")
@@ -27,19 +162,26 @@ async def verify(request: Request):
 
 
 @app.router.post("/api/whatsapp")
-async def webhook(wam: wa.WamBase = Depends(wa.process_webhook_data)):
-    if wam is None:
-        return JSONResponse(content="ok", status_code=200)
-
-    if isinstance(wam, wa.WamMediaType):
-        await wa.send_message(
-            recipient_id=wam.wa_id, message=f"Mmm, {wam.message_type}"
-        )
-    elif wam.message_type == "text":
-        await wa.send_message(recipient_id=wam.wa_id, message=wam.message_body)
+async def webhook(
+    wams: list[wa.WamBase | wa.WamStatus] = Depends(wa.read_webhook_events),
+):
+    # acknowledge right away, media downloads and replies run on the workers
+    try:
+        work_queue.enqueue(wams)
+    except wa.QueueFullError:
+        metrics.inc("whatsapp_webhook_rejected_total", reason="queue_full")
+        raise HTTPException(status_code=503, detail="Too many pending webhooks")
     return JSONResponse(content="ok", status_code=200)
 
 
+@app.router.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=wa.PROMETHEUS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
-    print("your verify token is: ", wa.WHATSAPP_VERIFY_TOKEN)
-    uvicorn.run("grannymail.main:app", reload=True)
+    # development server with reload, use `whatsapp-server` in production
+    import uvicorn
+
+    print("your verify token is: ", settings.verify_token)
+    uvicorn.run("main:app", reload=True)
@@ -0,0 +1,113 @@
+"""
+Production launcher for the webhook app.
+
+Runs `main:app` under uvicorn with one worker process per available core. Every
+worker imports the app itself, so each has its own event loop, pooled Graph API
+client and webhook queues. uvloop and httptools are used when installed
+(`pip install .[speedups]`). On SIGTERM uvicorn stops accepting connections,
+finishes in-flight requests and then runs the app's shutdown, which drains the
+accepted webhooks before the Graph client is closed.
+
+Usage: `whatsapp-server --port 8000`, see `whatsapp-server --help`.
+"""
+
+import argparse
+import importlib.util
+import math
+import os
+from pathlib import Path
+
+
+def available_cpus() -> int:
+    """
+    Return the number of cores this process may use.
+
+    Takes the CPU affinity and, in containers, the cgroup CPU quota into account,
+    which `os.cpu_count` does not.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+    except (OSError, ValueError):
+        return cpus
+    if quota == "max":
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    env = os.environ.get
+    parser = argparse.ArgumentParser(
+        description="Run the WhatsApp webhook app in production."
+    )
+    parser.add_argument("--host", default=env("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("PORT", 8000)))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(env("WEB_CONCURRENCY", 0)) or available_cpus(),
+        help="worker processes, defaults to the available cores",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=int(env("KEEP_ALIVE", 75)),
+        help="seconds idle connections are kept open, keep it above the idle "
+        "timeout of the load balancer in front",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=int(env("BACKLOG", 2048)),
+        help="connections the kernel queues while all workers are busy",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=int(env("SHUTDOWN_TIMEOUT", 30)),
+        help="seconds in-flight requests get to finish on shutdown",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=int(env("LIMIT_CONCURRENCY", 0)) or None,
+        help="connections per worker before new ones get a 503",
+    )
+    parser.add_argument("--log-level", default=env("LOG_LEVEL", "info").lower())
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    import uvicorn
+
+    args = build_parser().parse_args(argv)
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    print(
+        f"Starting {args.workers} workers on {args.host}:{args.port} "
+        f"({loop}, {http})"
+    )
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_concurrency=args.limit_concurrency,
+        log_level=args.log_level,
+        # requests are logged by the app's own logging pipeline
+        access_log=False,
+        proxy_headers=True,
+        server_header=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
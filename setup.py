@@ -1,9 +1,10 @@
-from setuptools import find_packages, setup
+from setuptools import setup
 
 setup(
     name="whatsapp",
     version="0.1",
-    packages=["whatsapp"],
+    py_modules=["whatsapp", "whatsapp_models", "main", "server"],
+    entry_points={"console_scripts": ["whatsapp-server=server:main"]},
     install_requires=[
         "annotated-types>=0.6.0",
         "anyio>=4.2.0",
@@ -32,4 +33,11 @@ setup(
         "urllib3>=2.1.0",
         "uvicorn>=0.27.0",
     ],
+    extras_require={
+        "speedups": [
+            "httptools>=0.6.1",
+            "orjson>=3.9.10",
+            "uvloop>=0.19.0; sys_platform != 'win32'",
+        ],
+    },
 )
@@ -172,3 +172,150 @@ def example_image_message():
             }
         ],
     )
+
+
+@pytest.fixture
+def example_batched_messages():
+    return WebhookRequestData(
+        object="whatsapp_business_account",
+        entry=[
+            {
+                "id": "206144975918077",
+                "changes": [
+                    {
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15551291301",
+                                "phone_number_id": "196914110180497",
+                            },
+                            "contacts": [
+                                {
+                                    "profile": {"name": "Dominique Paul"},
+                                    "wa_id": "4915159922222",
+                                },
+                                {
+                                    "profile": {"name": "Jane Doe"},
+                                    "wa_id": "4915159933333",
+                                },
+                            ],
+                            "messages": [
+                                {
+                                    "from": "4915159922222",
+                                    "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABIYFDNBQkFUQ0gwMDAwMDAwMDAwMDEA",
+                                    "timestamp": "1706312529",
+                                    "text": {"body": "First message"},
+                                    "type": "text",
+                                },
+                                {
+                                    "from": "4915159933333",
+                                    "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABIYFDNBQkFUQ0gwMDAwMDAwMDAwMDIA",
+                                    "timestamp": "1706312530",
+                                    "text": {"body": "Second message"},
+                                    "type": "text",
+                                },
+                            ],
+                        },
+                        "field": "messages",
+                    },
+                    {
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15551291301",
+                                "phone_number_id": "196914110180497",
+                            },
+                            "statuses": [
+                                {
+                                    "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABEYEjRCQkFUQ0hTVEFUVVMwMDAxAA==",
+                                    "status": "delivered",
+                                    "timestamp": "1706312531",
+                                    "recipient_id": "4915159922222",
+                                }
+                            ],
+                        },
+                        "field": "messages",
+                    },
+                ],
+            },
+            {
+                "id": "206144975918077",
+                "changes": [
+                    {
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15551291301",
+                                "phone_number_id": "196914110180497",
+                            },
+                            "contacts": [
+                                {
+                                    "profile": {"name": "Dominique Paul"},
+                                    "wa_id": "4915159922222",
+                                }
+                            ],
+                            "messages": [
+                                {
+                                    "from": "4915159922222",
+                                    "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABIYFDNBQkFUQ0gwMDAwMDAwMDAwMDMA",
+                                    "timestamp": "1706312532",
+                                    "text": {"body": "Third message"},
+                                    "type": "text",
+                                }
+                            ],
+                        },
+                        "field": "messages",
+                    }
+                ],
+            },
+        ],
+    )
+
+
+@pytest.fixture
+def example_button_reply():
+    return WebhookRequestData(
+        object="whatsapp_business_account",
+        entry=[
+            {
+                "id": "206144975918077",
+                "changes": [
+                    {
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15551291301",
+                                "phone_number_id": "196914110180497",
+                            },
+                            "contacts": [
+                                {
+                                    "profile": {"name": "Dominique Paul"},
+                                    "wa_id": "4915159922222",
+                                }
+                            ],
+                            "messages": [
+                                {
+                                    "context": {
+                                        "from": "15551291301",
+                                        "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABEYEjQ3QkJDOTlCRTAxRkZBQTg3MwA=",
+                                    },
+                                    "from": "4915159922222",
+                                    "id": "wamid.HBgNNDkxNTE1OTkyNjE2MhUCABIYFDNBNzM1RjM2QTkyMDU2QTg2NTFBAA==",
+                                    "timestamp": "1706568012",
+                                    "type": "interactive",
+                                    "interactive": {
+                                        "type": "button_reply",
+                                        "button_reply": {
+                                            "id": "choice2",
+                                            "title": "No thanks",
+                                        },
+                                    },
+                                }
+                            ],
+                        },
+                        "field": "messages",
+                    }
+                ],
+            }
+        ],
+    )
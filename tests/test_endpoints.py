@@ -1,12 +1,40 @@
+import dataclasses
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+
 import pytest
 from fastapi.testclient import TestClient
 
+import main
+import whatsapp as wa
 from main import app
 
-client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def dedup_store(mocker):
+    # every test starts without remembered wamids
+    return mocker.patch.object(main, "dedup_store", wa.InMemoryDedupStore())
+
+
+@pytest.fixture(autouse=True)
+def unsigned_webhooks(mocker):
+    # the tests post unsigned payloads, signatures are tested separately
+    settings = dataclasses.replace(wa.get_settings(), verify_signatures=False)
+    mocker.patch.object(wa, "_settings", settings)
 
 
-def test_verification_fails():
+@pytest.fixture
+def client():
+    # run the lifespan so the Graph client and the work queue are started
+    with TestClient(app) as client:
+        yield client
+
+
+def test_verification_fails(client):
     """
     Test webhook verification mechanism.
     """
@@ -25,7 +53,7 @@ def test_verification_fails():
 
 
 @pytest.mark.asyncio
-async def test_valid_whatsapp_message(mocker, example_text_message):
+async def test_valid_whatsapp_message(client, mocker, example_text_message):
     # Arrange
     data = example_text_message.model_dump(mode="json")
     mock_send_message = mocker.AsyncMock()
@@ -38,3 +66,146 @@ async def test_valid_whatsapp_message(mocker, example_text_message):
     # Assert
     assert response.status_code == 200
     assert response.content == b'"ok"'
+
+
+def test_batched_webhook_handles_every_message(mocker, example_batched_messages):
+    data = example_batched_messages.model_dump(mode="json")
+    mock_send_message = mocker.AsyncMock()
+    mocker.patch("whatsapp.send_message", new=mock_send_message)
+
+    with TestClient(app) as client:
+        response = client.post("/api/whatsapp", json=data)
+    # leaving the client drains the work queue
+
+    assert response.status_code == 200
+    assert mock_send_message.await_count == 3
+    sent = {call.kwargs["message"] for call in mock_send_message.await_args_list}
+    assert sent == {"First message", "Second message", "Third message"}
+
+
+def test_webhook_rejects_when_queue_is_full(client, mocker, example_text_message):
+    data = example_text_message.model_dump(mode="json")
+    mocker.patch.object(main.work_queue, "enqueue", side_effect=wa.QueueFullError)
+
+    response = client.post("/api/whatsapp", json=data)
+
+    assert response.status_code == 503
+
+
+def test_webhook_rejects_non_whatsapp_events(client):
+    response = client.post("/api/whatsapp", json={"object": "page", "entry": []})
+
+    assert response.status_code == 404
+
+
+def test_redelivered_webhook_is_handled_once(mocker, example_text_message):
+    data = example_text_message.model_dump(mode="json")
+    mock_send_message = mocker.AsyncMock()
+    mocker.patch("whatsapp.send_message", new=mock_send_message)
+
+    with TestClient(app) as client:
+        first = client.post("/api/whatsapp", json=data)
+        second = client.post("/api/whatsapp", json=data)
+
+    assert first.status_code == second.status_code == 200
+    assert mock_send_message.await_count == 1
+
+
+def test_webhook_rejects_invalid_json(client):
+    response = client.post(
+        "/api/whatsapp",
+        content=b"{not json",
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert response.status_code == 400
+
+
+def test_webhook_signature_is_verified(mocker, example_text_message):
+    settings = dataclasses.replace(
+        wa.get_settings(), app_secret="secret", verify_signatures=True
+    )
+    mocker.patch.object(wa, "_settings", settings)
+    mocker.patch("whatsapp.send_message", new=mocker.AsyncMock())
+    raw = json.dumps(example_text_message.model_dump(mode="json")).encode()
+    digest = hmac.new(b"secret", raw, hashlib.sha256).hexdigest()
+
+    with TestClient(app) as client:
+        for signature, status in [
+            (f"sha256={digest}", 200),
+            (f"sha256={'0' * 64}", 403),
+            (f"sha256={'é' * 64}".encode("latin-1"), 403),
+            (None, 403),
+        ]:
+            headers = {"Content-Type": "application/json"}
+            if signature:
+                headers["X-Hub-Signature-256"] = signature
+            response = client.post("/api/whatsapp", content=raw, headers=headers)
+            assert response.status_code == status, signature
+
+
+def test_webhooks_are_rejected_without_an_app_secret(mocker, example_text_message):
+    settings = dataclasses.replace(
+        wa.get_settings(), app_secret=None, verify_signatures=True
+    )
+    mocker.patch.object(wa, "_settings", settings)
+    data = example_text_message.model_dump(mode="json")
+
+    with TestClient(app) as client:
+        response = client.post("/api/whatsapp", json=data)
+
+    assert response.status_code == 500
+
+
+def test_app_starts_with_only_a_tenants_file(mocker):
+    settings = dataclasses.replace(wa.get_settings(), token=None, phone_number_id=None)
+    mocker.patch.object(wa, "_settings", settings)
+    mocker.patch.object(wa, "_default_client", None)
+    tenant = wa.WhatsAppClient("token-a", "111")
+    mocker.patch.object(wa, "_tenants", wa.TenantRegistry([tenant]))
+
+    with TestClient(app):
+        assert not tenant._client.is_closed
+        assert wa.get_client("111") is tenant
+
+    assert tenant._client.is_closed
+    assert wa._default_client is None, "No default client without credentials"
+
+
+def test_metrics_endpoint(mocker, example_image_message):
+    mocker.patch("whatsapp.send_message", new=mocker.AsyncMock())
+    data = example_image_message.model_dump(mode="json")
+
+    with TestClient(app) as client:
+        client.post("/api/whatsapp", json=data)
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    # the app's metrics live as long as the module, other tests add to them
+    assert 'whatsapp_webhook_events_total{type="image"}' in response.text
+    assert "whatsapp_webhook_queue_depth 0" in response.text
+
+
+def test_process_webhook_data_works_as_a_dependency(tmp_path, example_text_message):
+    # a fresh interpreter, so the lazily built model has not been touched yet
+    code = (
+        "import sys, fastapi, whatsapp as wa\n"
+        "from fastapi.testclient import TestClient\n"
+        "app = fastapi.FastAPI()\n"
+        "@app.post('/hook')\n"
+        "async def hook(events=fastapi.Depends(wa.process_webhook_data)):\n"
+        "    return [e.message_body for e in events]\n"
+        "print(TestClient(app).post('/hook', content=sys.stdin.read()).json())\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        input=example_text_message.model_dump_json(),
+        cwd=tmp_path,
+        env=os.environ | {"PYTHONPATH": root},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "['Hello, this is the message']"
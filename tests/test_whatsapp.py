@@ -1,3 +1,17 @@
+import asyncio
+import base64
+import dataclasses
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import httpx
 import pytest
 
 import whatsapp as wa
@@ -114,3 +128,829 @@ async def test_parse_image_message(example_image_message):
     assert isinstance(
         parsed_message.media_bytes, bytes
     ), "The media_bytes should be of type bytes."
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_connection_pool():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200, json={"contacts": [{"wa_id": "1"}], "messages": [{"id": "wamid.1"}]}
+        )
+
+    async with wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    ) as client:
+        pool = client.client
+        await client.send_message("4915159922222", "first")
+        await client.send_message("4915159922222", "second")
+        assert client.client is pool, "The pooled client should be reused"
+
+    assert client._client is None, "The pool should be closed on exit"
+    assert len(requests) == 2
+    assert str(requests[0].url) == "https://graph.facebook.com/v18.0/123/messages"
+    assert requests[0].headers["Authorization"] == "Bearer token"
+
+
+@pytest.mark.asyncio
+async def test_parse_webhook_events_batch(example_batched_messages):
+    events = await wa.parse_webhook_events(example_batched_messages)
+
+    messages = [e for e in events if isinstance(e, wa.WamBase)]
+    statuses = [e for e in events if isinstance(e, wa.WamStatus)]
+    assert [m.message_body for m in messages] == [
+        "First message",
+        "Second message",
+        "Third message",
+    ], "All messages across entries and changes should be parsed in order"
+    assert (
+        messages[1].profile_name == "Jane Doe"
+    ), "The contact should be matched to the sender of each message"
+    assert len(statuses) == 1
+    assert statuses[0].status == "delivered"
+    assert statuses[0].recipient_id == "4915159922222"
+
+
+@pytest.mark.asyncio
+async def test_work_queue_processes_items_and_drains_on_stop():
+    processed = []
+
+    async def handler(item):
+        await asyncio.sleep(0.01)
+        if item == "bad":
+            raise ValueError("boom")
+        processed.append(item)
+
+    queue = await wa.WorkQueue(handler, workers=2, maxsize=3).start()
+    for item in ["a", "b", "bad"]:
+        queue.enqueue(item)
+    with pytest.raises(wa.QueueFullError):
+        queue.enqueue("d")
+    await queue.stop()
+
+    assert sorted(processed) == ["a", "b"]
+    stats = queue.stats()
+    assert stats["processed"] == 2
+    assert stats["failed"] == 1
+    assert stats["rejected"] == 1
+    assert stats["workers"] == 0, "All workers should be stopped"
+
+
+@pytest.mark.asyncio
+async def test_in_memory_dedup_store_evicts_by_size_and_age(mocker):
+    store = wa.InMemoryDedupStore(max_size=2, ttl=60)
+
+    assert await store.add("a")
+    assert not await store.add("a"), "A repeated key should be a duplicate"
+    assert await store.add("b")
+    assert await store.add("c")
+    assert len(store) == 2
+    assert await store.add("a"), "The least recently seen key should be evicted"
+
+    mocker.patch("time.monotonic", return_value=time.monotonic() + 61)
+    assert await store.add("c"), "Expired keys should be accepted again"
+
+
+@pytest.mark.asyncio
+async def test_parse_webhook_events_skips_duplicates(mocker, example_image_message):
+    mock_download = mocker.patch(
+        "whatsapp.WhatsAppClient._download_media", return_value=b"img"
+    )
+    store = wa.InMemoryDedupStore()
+
+    first = await wa.parse_webhook_events(example_image_message, dedup=store)
+    second = await wa.parse_webhook_events(example_image_message, dedup=store)
+
+    assert len(first) == 1
+    assert second == [], "A redelivered message should be dropped"
+    mock_download.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_media_is_loaded_lazily(tmp_path, example_voice_message):
+    content = b"OggS" + bytes(200_000)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/v18.0/1048715742889904":
+            return httpx.Response(200, json={"url": "https://lookaside.test/audio"})
+        return httpx.Response(200, content=content)
+
+    parsed_message = await wa.parse_whatsapp_message(example_voice_message)
+    assert parsed_message.media_bytes == b"", "Parsing should not download media"
+
+    async with wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    ) as client:
+        chunks = [
+            c async for c in parsed_message.iter_bytes(chunk_size=65536, client=client)
+        ]
+        path = await parsed_message.save(tmp_path / "voice.ogg", client=client)
+        data = await parsed_message.read(client=client)
+
+    assert max(len(c) for c in chunks) <= 65536, "The media should be streamed"
+    assert b"".join(chunks) == content
+    assert path.read_bytes() == content
+    assert data == parsed_message.media_bytes == content
+    assert isinstance(data, memoryview) and data.readonly
+    assert len(requests) == 4, "The URL should be resolved once, then cached"
+
+
+@pytest.mark.asyncio
+async def test_media_content_is_cached_on_disk(tmp_path, example_image_message):
+    content = b"\xff\xd8" + bytes(1000)
+    sha256 = base64.b64encode(hashlib.sha256(content).digest()).decode()
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.host == "graph.facebook.com":
+            return httpx.Response(
+                200,
+                json={
+                    "url": "https://lookaside.test/image?ext=9999999999",
+                    "mime_type": "image/jpeg",
+                    "sha256": sha256,
+                    "file_size": len(content),
+                    "id": "897438572169645",
+                },
+            )
+        return httpx.Response(200, content=content)
+
+    parsed_message = await wa.parse_whatsapp_message(example_image_message)
+    async with wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        transport=httpx.MockTransport(handler),
+        media_cache_dir=tmp_path,
+    ) as client:
+        info = await client.get_media_info(parsed_message.media_id)
+        first = await client._download_media(parsed_message.media_id)
+        second = await client._download_media(parsed_message.media_id)
+        third = await client._download_media("other-id", sha256=sha256)
+
+    assert info.file_size == len(content)
+    assert first == second == third == content
+    assert len(requests) == 2, "Only one lookup and one download should happen"
+    assert (tmp_path / hashlib.sha256(content).hexdigest()).read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_send_pdf_uploads_identical_files_once():
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path.endswith("/media"):
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"id": "media-1"})
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+    async with wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    ) as client:
+        await asyncio.gather(
+            *(
+                client.send_pdf(
+                    f"49151{i}", b"%PDF-1.4", "invoice.pdf", "application/pdf"
+                )
+                for i in range(5)
+            )
+        )
+        other_id = await client.upload_media(
+            b"%PDF-1.5", "other.pdf", "application/pdf"
+        )
+
+    uploads = [r for r in requests if r.url.path.endswith("/media")]
+    sends = [
+        json.loads(r.content) for r in requests if r.url.path.endswith("/messages")
+    ]
+    assert len(uploads) == 2, "Identical content should be uploaded only once"
+    assert other_id == "media-1"
+    assert len(sends) == 5
+    assert sends[0]["document"] == {"id": "media-1", "filename": "invoice.pdf"}
+
+
+@pytest.mark.asyncio
+async def test_send_image_streams_file_and_caches_by_content(tmp_path):
+    content = os.urandom(600 * 1024)
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(content)
+    uploads = []
+    sends = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/media"):
+            uploads.append(request)
+            return httpx.Response(200, json={"id": "media-1"})
+        sends.append(json.loads(request.content))
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+    async with wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    ) as client:
+        await client.send_image("4915100000", path, caption="Look")
+        media_id = await client.upload_media(content, "copy.jpg", "image/jpeg")
+
+    assert len(uploads) == 1, "The same content should be uploaded only once"
+    assert media_id == "media-1"
+    upload = uploads[0]
+    assert int(upload.headers["Content-Length"]) == len(upload.content)
+    assert b'name="type"\r\n\r\nimage/jpeg\r\n' in upload.content
+    assert b'filename="photo.jpg"\r\nContent-Type: image/jpeg\r\n\r\n' in (
+        upload.content
+    )
+    assert content in upload.content
+    assert sends[0]["image"] == {"id": "media-1", "caption": "Look"}
+
+
+@pytest.mark.asyncio
+async def test_upload_media_from_async_iterator_is_not_retried():
+    bodies = []
+
+    async def chunks():
+        for i in range(3):
+            yield bytes([i]) * 1024
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(request.content)
+        if len(bodies) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"id": f"media-{len(bodies)}"})
+
+    async with wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        transport=httpx.MockTransport(handler),
+        retry_policy=wa.RetryPolicy(base_delay=0),
+    ) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.upload_media(chunks(), "voice.ogg")
+        first = await client.upload_media(chunks(), "voice.ogg")
+        second = await client.upload_media(io.BytesIO(b"OggS"), "voice.ogg")
+
+    assert len(bodies) == 3, "Streams are neither retried nor cached"
+    assert (first, second) == ("media-2", "media-3")
+    assert b"\x00" * 1024 + b"\x01" * 1024 + b"\x02" * 1024 in bodies[1]
+    assert b"audio/ogg" in bodies[2]
+
+
+@pytest.mark.asyncio
+async def test_send_bulk_reports_every_recipient():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+        to = json.loads(request.content)["to"]
+        if to == "13":
+            return httpx.Response(400, json={"error": {"code": 131026}})
+        return httpx.Response(200, json={"messages": [{"id": f"wamid.{to}"}]})
+
+    recipients = [str(i) for i in range(30)]
+    async with wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    ) as client:
+        results = [
+            r
+            async for r in client.send_bulk(
+                recipients,
+                wa.text_payload("Our summer sale starts today!"),
+                concurrency=5,
+                messages_per_second=1000,
+            )
+        ]
+
+    assert [r.completed for r in results] == list(range(1, 31))
+    assert {r.recipient_id for r in results} == set(recipients)
+    assert [r.recipient_id for r in results if not r.ok] == ["13"]
+    assert max_in_flight <= 5, "Concurrency should be bounded"
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = wa.TokenBucket(rate=50, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09, "5 refills at 50/s take at least 0.1s"
+
+
+@pytest.mark.asyncio
+async def test_send_is_retried_when_throttled_but_not_on_server_errors():
+    statuses = [429, 400, 200, 500]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        status = statuses[len(requests) - 1]
+        if status == 429:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        if status == 400:
+            return httpx.Response(400, json={"error": {"code": 130429}})
+        return httpx.Response(status, json={"messages": [{"id": "wamid.1"}]})
+
+    policy = wa.RetryPolicy(base_delay=0.001)
+    async with wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        transport=httpx.MockTransport(handler),
+        retry_policy=policy,
+    ) as client:
+        r = await client.send_message("4915159922222", "Hi")
+        assert r["messages"][0]["id"] == "wamid.1"
+        assert len(requests) == 3, "Throttled sends should be retried"
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.send_message("4915159922222", "Hi")
+        assert len(requests) == 4, "A send that may have been processed is not retried"
+
+
+@pytest.mark.asyncio
+async def test_idempotent_requests_are_retried_within_budget():
+    attempts = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(503)
+
+    policy = wa.RetryPolicy(
+        max_attempts=10, base_delay=0.001, budget=wa.RetryBudget(initial_tokens=3)
+    )
+    async with wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        transport=httpx.MockTransport(handler),
+        retry_policy=policy,
+    ) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.get_media_info("897438572169645")
+
+    assert attempts == 4, "Retries should stop once the budget is used up"
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_recovers(mocker):
+    healthy = False
+    attempts = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal attempts
+        attempts += 1
+        if healthy:
+            return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+        return httpx.Response(500)
+
+    breaker = wa.CircuitBreaker(min_calls=4, window=4, open_duration=30)
+    async with wa.WhatsAppClient(
+        "token",
+        "123",
+        "v18.0",
+        transport=httpx.MockTransport(handler),
+        circuit_breaker=breaker,
+    ) as client:
+        for _ in range(4):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.send_message("4915159922222", "Hi")
+        assert breaker.state == "open"
+
+        with pytest.raises(wa.CircuitOpenError):
+            await client.send_message("4915159922222", "Hi")
+        assert attempts == 4, "An open breaker should not call the API"
+
+        healthy = True
+        mocker.patch("time.monotonic", return_value=time.monotonic() + 31)
+        await client.send_message("4915159922222", "Hi")
+        assert breaker.state == "closed", "A successful probe should close it"
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_limiter_backs_off_and_grows():
+    limiter = wa.AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=10)
+
+    await limiter.acquire()
+    await limiter.acquire()
+    blocked = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not blocked.done(), "A third call should wait for a free slot"
+
+    limiter.release(latency=0.1, overloaded=False)
+    await asyncio.wait_for(blocked, 1)
+    assert limiter.limit == 2.5
+
+    limiter.release(latency=0.1, overloaded=True)
+    limiter.release(latency=0.1, overloaded=True)
+    assert limiter.limit == 1.25, "Throttling should only halve the limit once"
+    assert limiter.in_flight == 0
+
+
+def test_parse_webhook_body_matches_validated_path(
+    example_text_reply, example_voice_message, example_batched_messages
+):
+    for body in [example_text_reply, example_voice_message, example_batched_messages]:
+        raw = body.model_dump_json().encode()
+
+        assert wa.parse_webhook_body(raw) == list(wa.iter_webhook_events(body))
+
+    assert wa.parse_webhook_body(b'{"object": "page"}') == []
+    with pytest.raises(ValueError):
+        wa.parse_webhook_body(b"{not json")
+
+
+def test_verify_signature_rejects_malformed_headers():
+    digest = hmac.new(b"secret", b"{}", hashlib.sha256).hexdigest()
+
+    assert wa.verify_signature(b"{}", f"sha256={digest}", "secret")
+    for signature in [None, "", digest, f"sha256={digest[:-1]}é", "sha256=ü" * 9]:
+        assert not wa.verify_signature(b"{}", signature, "secret"), signature
+
+
+def test_messages_are_slotted_and_share_repeated_fields(example_batched_messages):
+    raw = example_batched_messages.model_dump_json().encode()
+    first, second = wa.parse_webhook_body(raw)[:2]
+
+    assert not hasattr(first, "__dict__"), "Messages should not carry a __dict__"
+    assert first.phone_number_id is second.phone_number_id
+    assert first.message_type is second.message_type
+
+
+@pytest.mark.asyncio
+async def test_parse_button_reply(example_button_reply):
+    result = await wa.parse_whatsapp_message(example_button_reply)
+
+    assert isinstance(result, wa.WamInteractiveReply)
+    assert result.reply_type == "button_reply"
+    assert result.reply_id == "choice2"
+    assert result.message_body == "No thanks"
+    assert result.reference_message_user_phone == "15551291301"
+
+
+def _with_message(body: wa.WebhookRequestData, message: dict) -> bytes:
+    data = body.model_dump(mode="json")
+    original = data["entry"][0]["changes"][0]["value"]["messages"][0]
+    data["entry"][0]["changes"][0]["value"]["messages"] = [
+        {k: original[k] for k in ("from", "id", "timestamp")} | message
+    ]
+    return json.dumps(data).encode()
+
+
+def test_parse_other_message_types(example_text_message):
+    location, reaction, unknown, malformed = (
+        wa.parse_webhook_body(_with_message(example_text_message, message))[0]
+        for message in [
+            {
+                "type": "location",
+                "location": {"latitude": 52.52, "longitude": 13.40, "name": "Berlin"},
+            },
+            {"type": "reaction", "reaction": {"message_id": "wamid.1", "emoji": "👍"}},
+            {"type": "order", "order": {"catalog_id": "1"}},
+            {"type": "video", "video": {}},
+        ]
+    )
+
+    assert isinstance(location, wa.WamLocation) and location.name == "Berlin"
+    assert isinstance(reaction, wa.WamReaction) and reaction.emoji == "👍"
+    assert isinstance(unknown, wa.WamUnknown)
+    assert unknown.payload["order"] == {"catalog_id": "1"}
+    assert isinstance(malformed, wa.WamUnknown), "Malformed messages should not raise"
+
+
+def test_register_message_type(mocker, example_text_message):
+    mocker.patch.dict(wa.MESSAGE_PARSERS)
+
+    @wa.register_message_type("order")
+    def parse_order(wam_data, message):
+        return wa.WamBase(**wam_data, message_body=message["order"]["catalog_id"])
+
+    raw = _with_message(
+        example_text_message, {"type": "order", "order": {"catalog_id": "42"}}
+    )
+    result = wa.parse_webhook_body(raw)[0]
+
+    assert type(result) is wa.WamBase
+    assert result.message_body == "42"
+
+
+def _status(wamid: str, status: str) -> wa.WamStatus:
+    return wa.WamStatus(
+        webhook_id="206144975918077",
+        wamid=wamid,
+        phone_number_id="196914110180497",
+        recipient_id="4915159922222",
+        status=status,
+        timestamp="1706312531",
+    )
+
+
+@pytest.mark.asyncio
+async def test_status_aggregator_coalesces_per_wamid():
+    batches = []
+    aggregator = wa.StatusAggregator(
+        wa.CallbackSink(batches.append), max_batch=2, flush_interval=60
+    )
+
+    await aggregator.start()
+    for wamid, status in [
+        ("wamid.1", "sent"),
+        ("wamid.1", "read"),
+        ("wamid.1", "delivered"),
+        ("wamid.2", "sent"),
+        ("wamid.3", "delivered"),
+    ]:
+        await aggregator.add(_status(wamid, status))
+    await aggregator.stop()
+
+    assert [[(s.wamid, s.status) for s in b] for b in batches] == [
+        [("wamid.1", "read"), ("wamid.2", "sent")],
+        [("wamid.3", "delivered")],
+    ], "Each batch should hold the furthest status per wamid"
+    assert aggregator.received == 5
+    assert aggregator.written == 3
+
+
+@pytest.mark.asyncio
+async def test_sqlite_status_sink_keeps_latest_status(tmp_path):
+    sink = wa.SqliteStatusSink(tmp_path / "statuses.db")
+
+    await sink.write([_status("wamid.1", "read"), _status("wamid.2", "sent")])
+    await sink.write([_status("wamid.1", "delivered"), _status("wamid.2", "failed")])
+    rows = sink._connect().execute(
+        "SELECT wamid, status FROM message_statuses ORDER BY wamid"
+    )
+
+    assert rows.fetchall() == [("wamid.1", "read"), ("wamid.2", "failed")]
+    await sink.close()
+
+
+@pytest.mark.asyncio
+async def test_router_dispatches_to_matching_handlers(
+    example_text_message, example_image_message
+):
+    router = wa.Router(default_timeout=0.05)
+    calls = []
+
+    @router.on_text(r"^Hello")
+    async def greet(wam):
+        calls.append("greet")
+
+    @router.on_text(r"^Bye")
+    async def farewell(wam):
+        calls.append("farewell")
+
+    @router.on_media("image")
+    async def image(wam):
+        calls.append("image")
+
+    @router.on()
+    async def any_message(wam):
+        calls.append("any")
+
+    @router.on(predicate=lambda wam: wam.message_type == "image")
+    async def slow(wam):
+        await asyncio.sleep(1)
+        calls.append("slow")
+
+    @router.on_status("read")
+    async def read(status):
+        calls.append("read")
+
+    text = await wa.parse_whatsapp_message(example_text_message)
+    image_message = await wa.parse_whatsapp_message(example_image_message)
+
+    assert await router.dispatch(text) == 2
+    assert sorted(calls) == ["any", "greet"]
+
+    calls.clear()
+    assert await router.dispatch(image_message) == 2, "The slow handler times out"
+    assert sorted(calls) == ["any", "image"]
+
+    calls.clear()
+    assert await router.dispatch(_status("wamid.1", "delivered")) == 0
+    assert await router.dispatch(_status("wamid.1", "read")) == 1
+    assert calls == ["read"]
+
+
+@pytest.mark.asyncio
+async def test_keyed_scheduler_orders_per_key_and_is_fair():
+    order = []
+    running = set()
+
+    def job(key, i):
+        async def run():
+            assert key not in running, "Jobs of one key must not overlap"
+            running.add(key)
+            await asyncio.sleep(0.001)
+            order.append((key, i))
+            running.discard(key)
+
+        return run
+
+    scheduler = await wa.KeyedScheduler(workers=1, max_per_key=5).start()
+    for i in range(5):
+        scheduler.submit("chatty", job("chatty", i))
+    scheduler.submit("quiet", job("quiet", 0))
+    with pytest.raises(wa.QueueFullError):
+        scheduler.submit("chatty", job("chatty", 5))
+    await scheduler.stop()
+
+    assert [i for key, i in order if key == "chatty"] == [0, 1, 2, 3, 4]
+    assert order.index(("quiet", 0)) == 1, "Other keys should not wait for a backlog"
+    assert scheduler.stats()["processed"] == 6
+
+
+@pytest.mark.asyncio
+async def test_durable_sends_survive_a_crash(tmp_path):
+    sent = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        if payload["text"]["body"] == "rejected":
+            return httpx.Response(400, json={"error": {"code": 100}})
+        sent.append(payload["text"]["body"])
+        return httpx.Response(200, json={"messages": [{"id": "wamid.x"}]})
+
+    outbox = wa.SqliteOutbox(tmp_path / "outbox.db")
+    client = wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler), outbox=outbox
+    )
+    r = await client.send_message("456", "hello", durable=True, idempotency_id="a")
+    assert r == {"idempotency_id": "a", "queued": True}
+    r = await client.send_message("456", "hello", durable=True, idempotency_id="a")
+    assert r["queued"] is False, "The same idempotency_id is only enqueued once"
+    await client.send_message("456", "later", durable=True, idempotency_id="b")
+    await client.send_message("456", "rejected", durable=True, idempotency_id="c")
+
+    # a dispatcher claims a message and dies before sending it
+    assert len(await outbox.claim(limit=1, lease=0.01)) == 1
+    await outbox.close()
+    await asyncio.sleep(0.02)
+
+    outbox = wa.SqliteOutbox(tmp_path / "outbox.db")
+    dispatcher = wa.OutboxDispatcher(client, outbox)
+    assert await dispatcher.drain_once() == 3, "The expired lease is claimed again"
+    assert sorted(sent) == ["hello", "later"]
+    assert await outbox.counts() == {"sent": 2, "dead": 1}
+    assert await dispatcher.drain_once() == 0
+    await outbox.close()
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_tenants_reply_from_the_receiving_number(example_image_message):
+    requests = []
+
+    def handler(request):
+        requests.append((request.url.path, request.headers["Authorization"]))
+        if request.url.path.endswith("/messages"):
+            return httpx.Response(200, json={"messages": [{"id": "wamid.x"}]})
+        if request.url.host == "graph.facebook.com":
+            return httpx.Response(200, json={"url": "https://cdn.example/media"})
+        return httpx.Response(200, content=b"image")
+
+    transport = httpx.MockTransport(handler)
+    registry = wa.TenantRegistry.from_config(
+        [
+            {"phone_number_id": "111", "token": "token-a"},
+            {"phone_number_id": "222", "token": "token-b", "messages_per_second": 5},
+        ],
+        transport=transport,
+    )
+    assert len(registry) == 2 and "222" in registry
+    assert registry.get("222").rate_limiter is not None
+    with pytest.raises(wa.UnknownTenantError):
+        registry.get("333")
+
+    previous = wa.get_tenants()
+    wa.set_tenants(registry)
+    try:
+        await wa.send_message("456", "hi", phone_number_id="222")
+        assert requests.pop() == ("/v18.0/222/messages", "Bearer token-b")
+        with pytest.raises(wa.UnknownTenantError):
+            await wa.send_message("456", "hi", phone_number_id="999")
+
+        image = await wa.parse_whatsapp_message(example_image_message)
+        image.phone_number_id = "111"
+        assert await image.read() == b"image"
+        assert requests[0][1] == "Bearer token-a"
+    finally:
+        wa.set_tenants(previous)
+        await registry.aclose()
+
+
+def test_import_is_free_of_configuration_and_heavy_dependencies(tmp_path):
+    env = {k: v for k, v in os.environ.items() if not k.startswith("WHATSAPP_")}
+    code = (
+        "import sys, whatsapp\n"
+        "loaded = [m for m in ('httpx', 'fastapi', 'pydantic') if m in sys.modules\n"
+        "          and not type(sys.modules[m]).__name__.startswith('_Lazy')]\n"
+        "assert not loaded, loaded\n"
+        "try:\n"
+        "    whatsapp.WhatsAppClient()\n"
+        "except whatsapp.ConfigurationError as e:\n"
+        "    print(e)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env=env | {"PYTHONPATH": root},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "WHATSAPP_TOKEN is not set."
+
+
+def test_settings_are_validated_and_injected():
+    with pytest.raises(wa.ConfigurationError):
+        wa.Settings(token="token", api_version="18")
+
+    settings = wa.Settings.from_env(
+        {"WHATSAPP_TOKEN": "token", "WHATSAPP_PHONE_NUMBER_ID": "123"}
+    )
+    assert settings.api_version == "v18.0"
+    client = wa.WhatsAppClient(settings=settings)
+    assert client.messages_url == "https://graph.facebook.com/v18.0/123/messages"
+    stand_in = dataclasses.replace(settings, graph_url="http://127.0.0.1:9000/")
+    client = wa.WhatsAppClient(settings=stand_in)
+    assert client.media_url == "http://127.0.0.1:9000/v18.0/123/media"
+    assert client.headers == {"Authorization": "Bearer token"}
+
+
+@pytest.mark.asyncio
+async def test_metrics_record_graph_calls_in_prometheus_format(monkeypatch):
+    def handler(request):
+        if json.loads(request.content)["to"] == "bad":
+            return httpx.Response(400, json={"error": {"code": 131026}})
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+    disabled = wa.Metrics()
+    disabled.inc("whatsapp_handler_total")
+    assert disabled.timer("send") is disabled.timer("upload")
+    assert disabled.render() == "\n"
+
+    metrics = wa.Metrics(enabled=True, buckets=(0.1, 1))
+    monkeypatch.setattr(wa, "_metrics", metrics)
+    client = wa.WhatsAppClient(
+        "token", "123", "v18.0", transport=httpx.MockTransport(handler)
+    )
+    metrics.track_client(client)
+    await client.send_message("456", "hi")
+    with pytest.raises(httpx.HTTPStatusError):
+        await client.send_message("bad", "hi")
+
+    text = metrics.render()
+    assert 'whatsapp_graph_responses_total{status="200",code=""} 1' in text
+    assert 'whatsapp_graph_responses_total{status="400",code="131026"} 1' in text
+    assert 'whatsapp_stage_seconds_bucket{stage="send",le="+Inf"} 2' in text
+    assert 'whatsapp_stage_seconds_count{stage="send"} 2' in text
+    assert 'whatsapp_stage_errors_total{stage="send",error="HTTPStatusError"} 1' in text
+    assert 'whatsapp_requests_in_flight{phone_number_id="123"} 0' in text
+    await client.aclose()
+
+
+def test_logging_is_sampled_capped_and_redacted():
+    stream = io.StringIO()
+    logger = logging.getLogger("test_whatsapp.logging")
+    logger.propagate = False
+    listener = wa.configure_logging(
+        stream=stream,
+        sample_rates={"sampled": 0},
+        rate_limits={"status": 3},
+        secrets=["s3cret-token", "x"],
+        logger=logger,
+    )
+    listener.start()
+    try:
+        for i in range(10):
+            logger.info(f"status {i}", extra={"category": "status"})
+            logger.info("never kept", extra={"category": "sampled"})
+        logger.error("failed", extra={"category": "sampled"})
+        logger.warning("sent with s3cret-token, Authorization: Bearer EAAG.x-y")
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    messages = [r["message"] for r in records]
+    assert messages[:3] == ["status 0", "status 1", "status 2"]
+    assert "never kept" not in messages
+    assert records[3]["message"] == "failed", "Errors are never dropped"
+    assert records[-1]["message"] == "sent with ***, Authorization: Bearer ***"
+    assert records[0]["category"] == "status"
@@ -1,27 +1,563 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import bisect
+import contextlib
+import copy
+import hashlib
+import hmac
+import importlib.util
+import inspect
 import json
 import logging
+import logging.handlers
+import mimetypes
+import mmap
 import os
-from dataclasses import dataclass, field
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Mapping,
+)
+from dataclasses import asdict, dataclass, field
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from types import ModuleType
+from typing import IO, TYPE_CHECKING, Any, Literal
+from urllib.parse import parse_qs, urlparse
 
-import httpx
-from dotenv import load_dotenv
-from fastapi import HTTPException, Request, Response
-from pydantic import BaseModel
 
-load_dotenv()
+def _lazy_import(name: str) -> ModuleType:
+    """
+    Import a module on first attribute access instead of right away.
 
-WHATSAPP_TOKEN = os.environ["WHATSAPP_TOKEN"]
-WHATSAPP_API_VERSION = os.environ["WHATSAPP_API_VERSION"]
-WHATSAPP_PHONE_NUMBER_ID = os.environ["WHATSAPP_PHONE_NUMBER_ID"]
-WHATSAPP_VERIFY_TOKEN = os.environ["WHATSAPP_VERIFY_TOKEN"]
+    httpx and fastapi take up most of the import time of this module, and e.g.
+    workers that only parse webhooks never touch them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
 
-class WebhookRequestData(BaseModel):
-    object: str = ""
-    entry: list = []
+if TYPE_CHECKING:
+    import fastapi
+    import httpx
 
+    import whatsapp_models as _models
+else:
+    httpx = _lazy_import("httpx")
+    fastapi = _lazy_import("fastapi")
+    # annotations refer to `_models.WebhookRequestData`, so FastAPI resolving
+    # them loads the model through this lazy module
+    _models = _lazy_import("whatsapp_models")
 
-@dataclass
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    try:
+        from msgspec.json import decode as _json_loads  # type: ignore
+    except ImportError:
+        from json import loads as _json_loads  # type: ignore
+
+
+MEDIA_TYPES = ("audio", "document", "image", "sticker", "video")
+DEFAULT_API_VERSION = "v18.0"
+GRAPH_URL = "https://graph.facebook.com"
+
+
+class ConfigurationError(ValueError):
+    """Raised when a required setting is missing or malformed."""
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """
+    The configuration of the WhatsApp integration.
+
+    Nothing is read from the environment when this module is imported. The
+    process-wide settings are loaded by `get_settings` the first time they are
+    needed, and can be passed to WhatsAppClient directly instead, e.g. in tests.
+
+    Args:
+        token (str, optional): The access token, WHATSAPP_TOKEN.
+        phone_number_id (str, optional): The phone number messages are sent from,
+            WHATSAPP_PHONE_NUMBER_ID.
+        api_version (str): The Graph API version, WHATSAPP_API_VERSION.
+        verify_token (str, optional): The token Meta sends when verifying the
+            webhook, WHATSAPP_VERIFY_TOKEN.
+        app_secret (str, optional): The secret of the Meta app, WHATSAPP_APP_SECRET.
+            Webhook requests without a valid X-Hub-Signature-256 header are
+            rejected.
+        verify_signatures (bool): Whether webhook signatures are checked,
+            WHATSAPP_VERIFY_SIGNATURES. Without an app secret all webhook requests
+            are rejected unless this is turned off with
+            WHATSAPP_VERIFY_SIGNATURES=0, e.g. for local development.
+        graph_url (str): The Graph API base URL, WHATSAPP_GRAPH_URL. Only changed
+            to point the client at a stand-in, e.g. for load tests.
+    """
+
+    token: str | None = None
+    phone_number_id: str | None = None
+    api_version: str = DEFAULT_API_VERSION
+    verify_token: str | None = None
+    app_secret: str | None = None
+    verify_signatures: bool = True
+    graph_url: str = GRAPH_URL
+
+    def __post_init__(self):
+        if not re.fullmatch(r"v\d+\.\d+", self.api_version):
+            raise ConfigurationError(
+                f"WHATSAPP_API_VERSION should look like 'v18.0', got {self.api_version!r}."
+            )
+
+    @classmethod
+    def from_env(
+        cls, environ: Mapping[str, str] | None = None, dotenv: bool = True
+    ) -> Settings:
+        """
+        Read the settings from environment variables.
+
+        Args:
+            environ (Mapping[str, str], optional): The variables. Defaults to
+                `os.environ`.
+            dotenv (bool): Load a `.env` file into `os.environ` first.
+
+        Returns:
+            Settings: The validated settings.
+        """
+        if environ is None:
+            if dotenv:
+                from dotenv import load_dotenv
+
+                load_dotenv()
+            environ = os.environ
+        return cls(
+            token=environ.get("WHATSAPP_TOKEN") or None,
+            phone_number_id=environ.get("WHATSAPP_PHONE_NUMBER_ID") or None,
+            api_version=environ.get("WHATSAPP_API_VERSION") or DEFAULT_API_VERSION,
+            verify_token=environ.get("WHATSAPP_VERIFY_TOKEN") or None,
+            app_secret=environ.get("WHATSAPP_APP_SECRET") or None,
+            verify_signatures=environ.get("WHATSAPP_VERIFY_SIGNATURES", "1") != "0",
+            graph_url=environ.get("WHATSAPP_GRAPH_URL") or GRAPH_URL,
+        )
+
+    def require(self, name: str) -> str:
+        """
+        Return a setting that has to be configured.
+
+        Raises:
+            ConfigurationError: If the setting is not set.
+        """
+        value = getattr(self, name)
+        if not value:
+            raise ConfigurationError(f"WHATSAPP_{name.upper()} is not set.")
+        return value
+
+
+_settings: Settings | None = None
+
+
+def get_settings() -> Settings:
+    """Return the process-wide settings, reading them from the environment once."""
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_env()
+    return _settings
+
+
+def set_settings(settings: Settings) -> None:
+    """Replace the process-wide settings."""
+    global _settings
+    _settings = settings
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_HELP = {
+    "whatsapp_stage_seconds": "Time spent per stage of webhook handling and Graph API calls.",
+    "whatsapp_stage_errors_total": "Stages that raised an exception, by exception type.",
+    "whatsapp_graph_request_seconds": "Latency of single Graph API requests.",
+    "whatsapp_graph_responses_total": "Graph API responses by HTTP status and Graph error code.",
+    "whatsapp_webhook_events_total": "Parsed webhook events by message type.",
+    "whatsapp_webhook_rejected_total": "Rejected webhook requests by reason.",
+    "whatsapp_media_info_cache_total": "Media URL lookups served from the cache or the Graph API.",
+    "whatsapp_media_download_bytes_total": "Downloaded media bytes by source.",
+    "whatsapp_handler_total": "Router handler runs by outcome.",
+    "whatsapp_concurrency_limit": "Current limit of concurrent Graph API requests.",
+    "whatsapp_requests_in_flight": "Graph API requests in flight.",
+    "whatsapp_circuit_open": "Whether the circuit breaker is open.",
+}
+
+
+class _StageTimer:
+    """Records the duration and failures of a stage, optionally inside a span."""
+
+    __slots__ = ("metrics", "stage", "start", "span")
+
+    def __init__(self, metrics: Metrics, stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.span: Any = None
+
+    def __enter__(self) -> _StageTimer:
+        if self.metrics.tracer is not None:
+            self.span = self.metrics.tracer.start_as_current_span(
+                f"whatsapp.{self.stage}"
+            )
+            self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.metrics.observe("whatsapp_stage_seconds", elapsed, stage=self.stage)
+        # a consumer closing a streaming stage early is not an error
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.metrics.inc(
+                "whatsapp_stage_errors_total",
+                stage=self.stage,
+                error=exc_type.__name__,
+            )
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+
+
+_NO_TIMER = contextlib.nullcontext()
+
+
+class Metrics:
+    """
+    In-process counters, latency histograms and gauges in the Prometheus format.
+
+    Metrics are disabled by default, in which case recording is a single attribute
+    check and `timer` returns a shared no-op context manager. Enable them in the
+    app with `set_metrics(Metrics(enabled=True))` and serve `render()` on /metrics.
+
+    Args:
+        enabled (bool): Record metrics. Defaults to False.
+        tracing (bool): Also open an OpenTelemetry span for every timed stage.
+            Requires the `opentelemetry-api` package and is ignored without it.
+        buckets (tuple[float, ...]): Upper bounds of the histogram buckets.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        tracing: bool = False,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.tracer: Any = None
+        if enabled and tracing:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                logging.warning("opentelemetry is not installed, tracing is off.")
+            else:
+                self.tracer = trace.get_tracer("whatsapp")
+        self._counters: defaultdict[str, dict[tuple, float]] = defaultdict(dict)
+        # per series: the count of every bucket and of +Inf, then the sum and count
+        self._histograms: defaultdict[str, dict[tuple, list]] = defaultdict(dict)
+        self._gauges: defaultdict[str, dict[tuple, Callable[[], float]]] = defaultdict(
+            dict
+        )
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increase a counter."""
+        if not self.enabled:
+            return
+        series = self._counters[name]
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record a value, e.g. a latency in seconds, in a histogram."""
+        if not self.enabled:
+            return
+        series = self._histograms[name]
+        key = tuple(labels.items())
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def gauge(self, name: str, fn: Callable[[], float], **labels: str) -> None:
+        """Register a callback whose value is read whenever metrics are rendered."""
+        self._gauges[name][tuple(labels.items())] = fn
+
+    def track_client(self, client: WhatsAppClient) -> None:
+        """Register gauges for the concurrency limiter and circuit breaker of a client."""
+        labels = {"phone_number_id": client.phone_number_id}
+        limiter, breaker = client.concurrency_limiter, client.circuit_breaker
+        self.gauge("whatsapp_concurrency_limit", lambda: limiter.limit, **labels)
+        self.gauge("whatsapp_requests_in_flight", lambda: limiter.in_flight, **labels)
+        self.gauge(
+            "whatsapp_circuit_open", lambda: float(breaker.state == "open"), **labels
+        )
+
+    def timer(self, stage: str) -> contextlib.AbstractContextManager:
+        """Return a context manager recording the duration of a stage."""
+        if not self.enabled:
+            return _NO_TIMER
+        return _StageTimer(self, stage)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        def header(name: str, kind: str) -> None:
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name, series in sorted(self._counters.items()):
+            header(name, "counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+        for name, series in sorted(self._histograms.items()):
+            header(name, "histogram")
+            for key, counts in series.items():
+                cumulative = 0
+                bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    le = _format_labels((*key, ("le", bound)))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {counts[-2]:g}")
+                lines.append(f"{name}_count{_format_labels(key)} {counts[-1]}")
+        for name, series in sorted(self._gauges.items()):
+            header(name, "gauge")
+            for key, fn in series.items():
+                lines.append(f"{name}{_format_labels(key)} {float(fn()):g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: tuple[tuple[str, Any], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Return the process-wide Metrics the module records into."""
+    return _metrics
+
+
+def set_metrics(metrics: Metrics) -> None:
+    """Replace the process-wide Metrics, e.g. with `Metrics(enabled=True)`."""
+    global _metrics
+    _metrics = metrics
+
+
+REDACTED = "***"
+# credentials that end up in URLs, headers or exception messages
+_SECRET_PATTERN = re.compile(
+    r"(?i)(bearer\s+|access_token=|hub\.verify_token=|appsecret_proof=)[^\s&\"',]+"
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line with secrets redacted.
+
+    Args:
+        secrets (Iterable[str | None]): Values, e.g. the access token, that are
+            replaced by "***" wherever they appear. Values shorter than 8
+            characters are ignored, they would mangle ordinary words. Bearer
+            tokens and token query parameters are redacted in any case.
+    """
+
+    def __init__(self, secrets: Iterable[str | None] = ()):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 8]
+
+    def redact(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, REDACTED)
+        return _SECRET_PATTERN.sub(rf"\1{REDACTED}", text)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S")
+            + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("category", "dropped"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return self.redact(json.dumps(entry, default=str))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the volume of high-frequency log records bounded.
+
+    The category of a record is its `category` extra, e.g.
+    `logging.info(..., extra={"category": "status"})`, or else its logger name.
+    Errors are never dropped. The next record of a category let through after
+    drops carries the number of dropped records in its `dropped` field.
+
+    Args:
+        sample_rates (dict[str, float], optional): Fraction of the records of a
+            category that is kept, e.g. {"status": 0.01}.
+        rate_limits (dict[str, float], optional): Maximum number of records of a
+            category per second.
+    """
+
+    def __init__(
+        self,
+        sample_rates: dict[str, float] | None = None,
+        rate_limits: dict[str, float] | None = None,
+    ):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self._windows: dict[str, list] = {}
+        self._dropped: defaultdict[str, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        category = getattr(record, "category", record.name)
+        rate = self.sample_rates.get(category)
+        if rate is not None and random.random() >= rate:
+            self._dropped[category] += 1
+            return False
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            now = time.monotonic()
+            window = self._windows.get(category)
+            if window is None or now - window[0] >= 1:
+                window = self._windows[category] = [now, 0]
+            if window[1] >= limit:
+                self._dropped[category] += 1
+                return False
+            window[1] += 1
+        if category in self._dropped:
+            record.dropped = self._dropped.pop(category)
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener thread, dropping them once `max_size` wait.
+
+    Only the message is rendered on the calling thread. Formatting, redaction and
+    I/O happen on the listener thread, so logging never blocks the event loop.
+
+    Args:
+        max_size (int): Maximum number of records waiting. Defaults to 10000.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        super().__init__(queue.SimpleQueue())
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the arguments may change before the listener gets to the record
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def configure_logging(
+    *,
+    level: int | str = logging.INFO,
+    filename: str | os.PathLike | None = None,
+    stream: IO[str] | None = None,
+    sample_rates: dict[str, float] | None = None,
+    rate_limits: dict[str, float] | None = None,
+    secrets: Iterable[str | None] = (),
+    max_queue_size: int = 10_000,
+    logger: logging.Logger | None = None,
+) -> logging.handlers.QueueListener:
+    """
+    Log JSON lines through a bounded queue drained by a background thread.
+
+    Args:
+        level (int | str): The level of `logger`. Defaults to INFO.
+        filename (str | os.PathLike, optional): The file to append to. Defaults
+            to `stream`.
+        stream (IO[str], optional): The stream to write to. Defaults to stderr.
+        sample_rates (dict[str, float], optional): See SamplingFilter.
+        rate_limits (dict[str, float], optional): See SamplingFilter.
+        secrets (Iterable[str | None]): Values redacted from every record.
+        max_queue_size (int): Records waiting beyond this are dropped.
+        logger (logging.Logger, optional): The logger to configure. Defaults to
+            the root logger.
+
+    Returns:
+        logging.handlers.QueueListener: The listener writing the records. Call
+            `start` on startup and `stop` on shutdown to flush what is queued.
+    """
+    target: logging.Handler
+    if filename is not None:
+        target = logging.FileHandler(filename)
+    else:
+        target = logging.StreamHandler(stream)
+    target.setFormatter(JsonFormatter(secrets))
+    handler = BoundedQueueHandler(max_queue_size)
+    handler.addFilter(SamplingFilter(sample_rates, rate_limits))
+    logger = logger or logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    return logging.handlers.QueueListener(handler.queue, target)
+
+
+def __getattr__(name: str) -> Any:
+    # building the pydantic model takes longer than importing the rest of this
+    # module, and only the pydantic-based parsing helpers need it
+    if name == "WebhookRequestData":
+        return _models.WebhookRequestData
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@dataclass(slots=True)
 class WamBase:
     webhook_id: str
     wamid: str
@@ -34,15 +570,166 @@ class WamBase:
     reference_wamid: str | None = field(default=None, kw_only=True)
     reference_message_user_phone: str | None = field(default=None, kw_only=True)
 
+    def __post_init__(self) -> None:
+        # the same few values repeat across every message of a number, share them
+        self.webhook_id = sys.intern(self.webhook_id)
+        self.phone_number_id = sys.intern(self.phone_number_id)
+        self.wa_id = sys.intern(self.wa_id)
+        self.message_type = sys.intern(self.message_type)
 
-@dataclass
+
+@dataclass(slots=True)
 class WamMediaType(WamBase):
     mime_type: str
     media_id: str
-    media_bytes: bytes = field(default=b"")
+    media_bytes: bytes | memoryview = field(default=b"")
+    sha256: str = field(default="")
+    filename: str = field(default="")
+
+    async def get_url(self, client: "WhatsAppClient | None" = None) -> str:
+        """Resolve the short-lived download URL of the media."""
+        return await (client or get_client(self.phone_number_id))._get_media_url(
+            self.media_id
+        )
+
+    async def iter_bytes(
+        self, chunk_size: int = 64 * 1024, client: "WhatsAppClient | None" = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream the media content in chunks without holding the whole file in memory.
+
+        Args:
+            chunk_size (int): The size of the chunks in bytes. Defaults to 64 KiB.
+            client (WhatsAppClient, optional): The client to download with.
+                Defaults to the client of the phone number that received the media.
+
+        Yields:
+            bytes: The next chunk of the media file.
+        """
+        async for chunk in (client or get_client(self.phone_number_id)).stream_media(
+            self.media_id, chunk_size=chunk_size, sha256=self.sha256
+        ):
+            yield chunk
+
+    async def read(self, client: "WhatsAppClient | None" = None) -> bytes | memoryview:
+        """
+        Download the media into memory, caching it in `media_bytes`.
+
+        The chunks are collected into a single buffer which is exposed as a
+        read-only memoryview, so the content is never copied once downloaded.
+        Prefer `iter_bytes` or `save` for large documents, audio or video.
+        """
+        if not self.media_bytes:
+            buffer = bytearray()
+            async for chunk in self.iter_bytes(client=client):
+                buffer += chunk
+            self.media_bytes = memoryview(buffer).toreadonly()
+        return self.media_bytes
+
+    async def save(
+        self,
+        path: str | os.PathLike | None = None,
+        client: "WhatsAppClient | None" = None,
+    ) -> Path:
+        """
+        Spool the media to disk chunk by chunk.
+
+        Args:
+            path (str | os.PathLike, optional): Where to write the file. Defaults to a
+                new temporary file which the caller is responsible for deleting.
+            client (WhatsAppClient, optional): The client to download with.
+
+        Returns:
+            Path: The path of the written file.
+        """
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="whatsapp-", suffix=f"-{self.media_id}")
+            os.close(fd)
+        with open(path, "wb") as f:
+            async for chunk in self.iter_bytes(client=client):
+                f.write(chunk)
+        return Path(path)
+
+
+@dataclass(slots=True)
+class WamInteractiveReply(WamBase):
+    """A tap on a reply button or list row, e.g. of `send_quick_reply_message`."""
+
+    reply_type: str
+    reply_id: str
+    title: str
+    description: str = ""
+
 
+@dataclass(slots=True)
+class WamButton(WamBase):
+    """A tap on a quick reply button of a template message."""
 
-def verify(request: Request):
+    payload: str
+
+
+@dataclass(slots=True)
+class WamLocation(WamBase):
+    latitude: float
+    longitude: float
+    name: str = ""
+    address: str = ""
+    url: str = ""
+
+
+@dataclass(slots=True)
+class WamContacts(WamBase):
+    contacts: list[dict] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class WamReaction(WamBase):
+    """An emoji reaction to a message. An empty emoji removes the reaction."""
+
+    reacted_wamid: str
+    emoji: str
+
+
+@dataclass(slots=True)
+class WamUnknown(WamBase):
+    """A message type without a registered parser, keeping the raw message."""
+
+    payload: dict = field(default_factory=dict)
+
+
+# a message goes sent -> delivered -> read, failed is final
+STATUS_RANKS = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+
+@dataclass(slots=True)
+class WamStatus:
+    """A delivery status update (sent, delivered, read or failed) of a sent message."""
+
+    webhook_id: str
+    wamid: str
+    phone_number_id: str
+    recipient_id: str
+    status: str
+    timestamp: str
+    conversation_id: str | None = None
+    conversation_category: str | None = None
+    billable: bool | None = None
+    pricing_category: str | None = None
+    errors: list[dict] = field(default_factory=list)
+
+    @property
+    def rank(self) -> int:
+        """How far the message got, later statuses of a wamid rank higher."""
+        return STATUS_RANKS.get(self.status, 0)
+
+    def __post_init__(self) -> None:
+        self.webhook_id = sys.intern(self.webhook_id)
+        self.phone_number_id = sys.intern(self.phone_number_id)
+        self.recipient_id = sys.intern(self.recipient_id)
+        self.status = sys.intern(self.status)
+
+
+def verify(request: fastapi.Request):
     """
     On webook verification VERIFY_TOKEN has to match the token at the
     configuration and send back "hub.challenge" as success.
@@ -52,33 +739,65 @@ def verify(request: Request):
     token = request.query_params.get("hub.verify_token")
 
     if mode and challenge:
-        if token != WHATSAPP_VERIFY_TOKEN:
-            return Response(content="Verification token mismatch", status_code=403)
-        return Response(content=request.query_params["hub.challenge"])
+        verify_token = get_settings().verify_token
+        if not verify_token or token != verify_token:
+            return fastapi.Response(
+                content="Verification token mismatch", status_code=403
+            )
+        return fastapi.Response(content=request.query_params["hub.challenge"])
 
-    return Response(content="Required arguments haven't passed.", status_code=400)
+    return fastapi.Response(
+        content="Required arguments haven't passed.", status_code=400
+    )
 
 
-async def process_webhook_data(data: WebhookRequestData) -> WamBase | None:
-    if data.entry[0].get("changes", [{}])[0].get("value", {}).get("statuses"):
-        logging.info("Received a WhatsApp status update.")
-        return None
-    # if not a status update
+async def process_webhook_data(
+    data: _models.WebhookRequestData,
+) -> list[WamBase | WamStatus]:
     try:
         if is_valid_whatsapp_message(data):
-            wam = await parse_whatsapp_message(data)
-            return wam
+            with _metrics.timer("webhook_parse"):
+                events = await parse_webhook_events(data)
+            if any(isinstance(e, WamStatus) for e in events):
+                logging.info(
+                    "Received a WhatsApp status update.", extra={"category": "status"}
+                )
+            return events
         else:
             # if the request is not a WhatsApp API event, return an error
-            raise HTTPException(status_code=404, detail="Not a WhatsApp API event")
+            raise fastapi.HTTPException(
+                status_code=404, detail="Not a WhatsApp API event"
+            )
     except json.JSONDecodeError:
         logging.error("Failed to decode JSON")
-        raise HTTPException(status_code=400, detail="Invalid JSON provided")
+        raise fastapi.HTTPException(status_code=400, detail="Invalid JSON provided")
 
 
-def is_valid_whatsapp_message(body: WebhookRequestData) -> bool:
+def validate_webhook_data(
+    data: _models.WebhookRequestData,
+) -> _models.WebhookRequestData:
     """
-    Validates the structure of the incoming webhook event to ensure it contains a WhatsApp message.
+    Check that the request is a WhatsApp API event without parsing it further.
+
+    Use this as a FastAPI dependency when the payload is handed to a `WorkQueue`
+    instead of being processed within the request.
+    """
+    if not is_valid_whatsapp_message(data):
+        raise fastapi.HTTPException(status_code=404, detail="Not a WhatsApp API event")
+    return data
+
+
+def _iter_change_values(entries: list) -> Iterator[tuple[dict, dict]]:
+    """Yield (entry, value) pairs for every change of every entry in the payload."""
+    for entry in entries:
+        for change in entry.get("changes", []):
+            yield entry, change.get("value", {})
+
+
+def is_valid_whatsapp_message(body: _models.WebhookRequestData) -> bool:
+    """
+    Validates the structure of the incoming webhook event to ensure it contains
+    at least one WhatsApp message or status update.
 
     Args:
         body (WebhookRequestData): The incoming webhook request data.
@@ -87,35 +806,142 @@ def is_valid_whatsapp_message(body: WebhookRequestData) -> bool:
         bool: True if the message structure is valid, False otherwise.
     """
     try:
-        return bool(body.entry[0]["changes"][0]["value"]["messages"][0])
-    except (IndexError, KeyError):
+        return any(
+            value.get("messages") or value.get("statuses")
+            for _, value in _iter_change_values(body.entry)
+        )
+    except AttributeError:
         return False
 
 
-async def parse_whatsapp_message(body: WebhookRequestData) -> WamBase:
-    """
-    Parse the incoming webhook request data and return an instance of WamBase or WamMediaType.
+def _parse_status(entry: dict, value: dict, status: dict) -> WamStatus:
+    conversation = status.get("conversation", {})
+    pricing = status.get("pricing", {})
+    return WamStatus(
+        webhook_id=entry["id"],
+        wamid=status["id"],
+        phone_number_id=value["metadata"]["phone_number_id"],
+        recipient_id=status["recipient_id"],
+        status=status["status"],
+        timestamp=status["timestamp"],
+        conversation_id=conversation.get("id"),
+        conversation_category=conversation.get("origin", {}).get("type"),
+        billable=pricing.get("billable"),
+        pricing_category=pricing.get("category"),
+        errors=status.get("errors", []),
+    )
 
-    This function extracts the necessary information from the webhook request data to
-    instantiate and return a WamBase dataclass object for text messages or a WamMediaType
-    dataclass object for media messages (audio, document, image). If the message type is
-    unsupported, it raises a ValueError.
 
-    Args:
-        body (WebhookRequestData): The incoming webhook request data.
+MessageParser = Callable[[dict, dict], WamBase]
 
-    Returns:
-        WamBase: An instance of WamBase for text messages.
-        WamMediaType: An instance of WamMediaType for media messages.
+# message type -> parser building the dataclass from the common fields and the message
+MESSAGE_PARSERS: dict[str, MessageParser] = {}
+
+
+def register_message_type(
+    *message_types: str,
+) -> Callable[[MessageParser], MessageParser]:
+    """
+    Register a parser for one or more inbound message types.
+
+    The parser is called with the fields shared by all messages (keyword arguments
+    for WamBase) and the raw message dict, and returns a WamBase instance.
+    Registering a type that already has a parser replaces it.
+
+    Example:
+        @register_message_type("order")
+        def parse_order(wam_data: dict, message: dict) -> WamBase:
+            return WamUnknown(**wam_data, payload=message["order"])
     """
-    values = body.entry[0]["changes"][0]["value"]
-    message = values["messages"][0]
+
+    def decorator(parser: MessageParser) -> MessageParser:
+        for message_type in message_types:
+            MESSAGE_PARSERS[message_type] = parser
+        return parser
+
+    return decorator
+
+
+@register_message_type("text")
+def _parse_text(wam_data: dict, message: dict) -> WamBase:
+    return WamBase(**wam_data, message_body=message["text"]["body"])
+
+
+@register_message_type(*MEDIA_TYPES)
+def _parse_media(wam_data: dict, message: dict) -> WamBase:
+    media = message[message["type"]]
+    return WamMediaType(
+        **wam_data,
+        mime_type=media["mime_type"],
+        media_id=media["id"],
+        sha256=media.get("sha256", ""),
+        filename=media.get("filename", ""),
+        message_body=media.get("caption", ""),
+    )
+
+
+@register_message_type("interactive")
+def _parse_interactive(wam_data: dict, message: dict) -> WamBase:
+    interactive = message["interactive"]
+    reply = interactive[interactive["type"]]
+    return WamInteractiveReply(
+        **wam_data,
+        reply_type=interactive["type"],
+        reply_id=reply["id"],
+        title=reply["title"],
+        description=reply.get("description", ""),
+        message_body=reply["title"],
+    )
+
+
+@register_message_type("button")
+def _parse_button(wam_data: dict, message: dict) -> WamBase:
+    button = message["button"]
+    return WamButton(
+        **wam_data, payload=button.get("payload", ""), message_body=button["text"]
+    )
+
+
+@register_message_type("location")
+def _parse_location(wam_data: dict, message: dict) -> WamBase:
+    location = message["location"]
+    return WamLocation(
+        **wam_data,
+        latitude=location["latitude"],
+        longitude=location["longitude"],
+        name=location.get("name", ""),
+        address=location.get("address", ""),
+        url=location.get("url", ""),
+    )
+
+
+@register_message_type("contacts")
+def _parse_contacts(wam_data: dict, message: dict) -> WamBase:
+    return WamContacts(**wam_data, contacts=message["contacts"])
+
+
+@register_message_type("reaction")
+def _parse_reaction(wam_data: dict, message: dict) -> WamBase:
+    reaction = message["reaction"]
+    return WamReaction(
+        **wam_data,
+        reacted_wamid=reaction["message_id"],
+        emoji=reaction.get("emoji", ""),
+    )
+
+
+def _parse_message(entry: dict, value: dict, message: dict) -> WamBase:
+    contacts = value.get("contacts") or [{}]
+    contact = next(
+        (c for c in contacts if c.get("wa_id") == message.get("from")),
+        contacts[0],
+    )
     wam_data = {
-        "webhook_id": body.entry[0]["id"],
+        "webhook_id": entry["id"],
         "wamid": message["id"],
-        "phone_number_id": values["metadata"]["phone_number_id"],
-        "wa_id": values["contacts"][0]["wa_id"],
-        "profile_name": values["contacts"][0]["profile"]["name"],
+        "phone_number_id": value["metadata"]["phone_number_id"],
+        "wa_id": contact.get("wa_id", message.get("from", "")),
+        "profile_name": contact.get("profile", {}).get("name", ""),
         "message_type": message["type"],
         "timestamp": message["timestamp"],
     }
@@ -124,197 +950,2923 @@ async def parse_whatsapp_message(body: WebhookRequestData) -> WamBase:
         wam_data.update(
             {
                 "reference_wamid": message["context"]["id"],
-                "reference_message_user_phone": message["context"]["from"],
-            }
-        )
-    if message["type"] == "text":
-        wam_data["message_body"] = message["text"]["body"]
-    elif message["type"] in ["audio", "document", "image"]:
-        wam_data.update(
-            {
-                "mime_type": message[message["type"]]["mime_type"],
-                "media_id": message[message["type"]]["id"],
+                "reference_message_user_phone": message["context"].get("from"),
             }
         )
-        wam_media = WamMediaType(**wam_data)
-        wam_media.media_bytes = await _download_media(wam_media.media_id)
-        return wam_media
-    else:
-        raise ValueError(f"Unsupported message type: '{message['type']}'")
 
-    return WamBase(**wam_data)
+    parser = MESSAGE_PARSERS.get(message["type"])
+    if parser is not None:
+        try:
+            return parser(wam_data, message)
+        except (KeyError, TypeError, ValueError):
+            # a malformed message must not fail the webhook and trigger redeliveries
+            logging.warning(
+                f"Failed to parse {message['type']} message {message['id']}",
+                exc_info=True,
+                extra={"category": "parse"},
+            )
+    return WamUnknown(**wam_data, payload=message)
 
 
-async def _download_media(media_id) -> bytes:
+def iter_webhook_events(
+    body: _models.WebhookRequestData,
+) -> Iterator[WamBase | WamStatus]:
     """
-    Download media from the given media_id.
+    Yield every status update and message contained in the webhook request data.
 
-    This function uses the media_id to construct a URL to the media file,
-    sends a GET request to that URL, and returns the content of the response.
-    If the media file cannot be found or accessed, an HTTP error is raised.
+    Meta batches several entries, changes, messages and statuses into a single
+    request under load, so all of them are walked instead of only the first one.
+    No network I/O happens here; media messages are yielded without their content.
 
     Args:
-        media_id (str): The ID of the media file to download.
+        body (WebhookRequestData): The incoming webhook request data.
 
-    Returns:
-        bytes: The content of the media file.
+    Yields:
+        WamStatus | WamBase | WamMediaType: One object per status or message.
     """
-    endpoint = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{media_id}"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
+    return _iter_events(body.entry)
 
-    async with httpx.AsyncClient(timeout=10) as client:
-        response = await client.get(endpoint, headers=headers)
-        response.raise_for_status()
-        download_url = response.json()["url"]
 
-        response = await client.get(download_url, headers=headers)
-        response.raise_for_status()
-        return response.content
+def _iter_events(entries: list) -> Iterator[WamBase | WamStatus]:
+    for entry, value in _iter_change_values(entries):
+        for status in value.get("statuses", ()):
+            yield _parse_status(entry, value, status)
+        for message in value.get("messages", ()):
+            yield _parse_message(entry, value, message)
 
 
-async def _post_httpx_request(
-    url: str, data: dict | None = None, files: dict | None = None
-) -> dict:
+def decode_webhook_body(raw: bytes) -> dict:
+    """
+    Decode the raw webhook request body, using orjson or msgspec when installed.
+
+    Raises:
+        ValueError: If the body is not a JSON object.
+    """
+    try:
+        data = _json_loads(raw)
+    except Exception as e:
+        raise ValueError("Invalid JSON provided") from e
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    return data
+
+
+def parse_webhook_body(raw: bytes) -> list[WamBase | WamStatus]:
     """
-    Send a POST request to the given URL with the provided data and files.
+    Parse the raw webhook request body straight into message and status objects.
 
-    This function constructs a POST request with the given data and files,
-    sends the request to the given URL, and returns the JSON content of the response.
-    If the response contains more than one contact or message, a ValueError is raised.
+    This is the fast path for the webhook: the body is decoded exactly once and
+    walked without validating it into WebhookRequestData first.
 
     Args:
-        url (str): The URL to send the POST request to.
-        data (dict, optional): The data to include in the request body. Defaults to None.
-        files (dict, optional): The files to include in the request body. Defaults to None.
+        raw (bytes): The raw request body.
 
     Returns:
-        dict: The JSON content of the response.
-    """
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
-    print(WHATSAPP_TOKEN)
-    if data:
-        headers["Content-Type"] = "application/json"
-    async with httpx.AsyncClient(timeout=10) as client:
-        response = await client.post(url, json=data, headers=headers, files=files)
-        response.raise_for_status()
-
-    r = response.json()
-    if data and (
-        "contacts" in r
-        and len(r["contacts"]) > 1
-        or "messages" in r
-        and len(r["messages"]) > 1
-    ):
-        raise ValueError("Expected only one contact and one message in the response.")
+        list[WamBase | WamStatus]: The parsed events in the order they were received.
 
-    return r
+    Raises:
+        ValueError: If the body is not valid JSON.
+    """
+    entries = decode_webhook_body(raw).get("entry")
+    if not isinstance(entries, list):
+        return []
+    return list(_iter_events(entries))
 
 
-async def send_message(recipient_id: str, message: str) -> dict:
+def verify_signature(raw: bytes, signature: str | None, app_secret: str) -> bool:
     """
-    Send a text message to the recipient.
+    Check the X-Hub-Signature-256 header Meta signs webhook requests with.
 
-    This function constructs a message with the given recipient_id and message,
-    sends the message to the recipient, and returns the JSON content of the response.
+    The signature is an HMAC-SHA256 of the raw request body keyed with the app
+    secret, so it has to be checked on the bytes as received rather than on
+    re-serialized JSON. The digests are compared in constant time.
 
     Args:
-        recipient_id (str): The ID of the recipient to send the message to.
-        message (str): The message to send.
+        raw (bytes): The raw request body.
+        signature (str, optional): The header value, "sha256=<hex digest>".
+        app_secret (str): The secret of the Meta app.
 
     Returns:
-        dict: The JSON content of the response.
+        bool: Whether the signature is valid.
     """
-    data = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": recipient_id,
-        "type": "text",
-        "text": {"preview_url": False, "body": message},
-    }
-    url = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    return await _post_httpx_request(url, data=data)
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode(), raw, hashlib.sha256).hexdigest()
+    # compared as bytes, compare_digest rejects str with non-ASCII characters
+    received = signature.removeprefix("sha256=").encode()
+    return hmac.compare_digest(expected.encode(), received)
 
 
-async def send_quick_reply_message(
-    recipient_id: str, message: str, buttons: list[str]
-) -> dict:
+async def read_webhook_body(request: fastapi.Request) -> bytes:
     """
-    Send a quick reply message with buttons to the recipient.
+    FastAPI dependency returning the raw webhook body once its signature is verified.
 
-    This function constructs a message with the given recipient_id and message,
-    adds quick reply buttons, sends the message to the recipient, and returns
-    the JSON content of the response.
+    The body is read once and shared with the parsers. Forged requests are
+    rejected before any JSON is decoded. Without an app secret in the settings
+    every request is rejected, unless signature checks are turned off.
 
-    Args:
-        recipient_id (str): The ID of the recipient to send the message to.
-        message (str): The message to send.
-        buttons (list[str]): A list of button titles for quick replies.
+    Raises:
+        fastapi.HTTPException: 403 if the signature is missing or invalid, 500 if
+            no app secret is configured.
+    """
+    raw = await request.body()
+    settings = get_settings()
+    if not settings.verify_signatures:
+        return raw
+    if settings.app_secret is None:
+        logging.error(
+            "Rejected a webhook request, WHATSAPP_APP_SECRET is not set. Set "
+            "WHATSAPP_VERIFY_SIGNATURES=0 to accept unsigned requests.",
+            extra={"category": "webhook"},
+        )
+        _metrics.inc("whatsapp_webhook_rejected_total", reason="no_app_secret")
+        raise fastapi.HTTPException(
+            status_code=500, detail="Webhook signatures cannot be verified"
+        )
+    if not verify_signature(
+        raw, request.headers.get("X-Hub-Signature-256"), settings.app_secret
+    ):
+        logging.warning(
+            "Rejected a webhook request with an invalid signature.",
+            extra={"category": "webhook"},
+        )
+        _metrics.inc("whatsapp_webhook_rejected_total", reason="signature")
+        raise fastapi.HTTPException(status_code=403, detail="Invalid signature")
+    return raw
 
-    Returns:
-        dict: The JSON content of the response.
+
+async def read_webhook_data(request: fastapi.Request) -> _models.WebhookRequestData:
     """
-    btns = [
-        {"type": "reply", "reply": {"id": f"choice{idx+1}", "title": b}}
-        for idx, b in enumerate(buttons)
-    ]
-    data = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": recipient_id,
-        "type": "interactive",
-        "interactive": {
-            "type": "button",
-            "body": {"text": message},
-            "action": {"buttons": btns},
-        },
-    }
-    endpoint = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    return await _post_httpx_request(endpoint, data=data)
+    FastAPI dependency validating the signed webhook body into WebhookRequestData.
 
+    Use it with `process_webhook_data` for the pydantic-based parsing path.
 
-async def _upload_media(file_data: bytes, file_name: str, mime_type: str) -> dict:
+    Raises:
+        fastapi.HTTPException: 403 for an invalid signature, 400 for invalid JSON.
     """
-    Uploads a media file to the server.
+    raw = await read_webhook_body(request)
+    try:
+        return _models.WebhookRequestData.model_validate_json(raw)
+    except ValueError:
+        logging.error("Failed to decode JSON")
+        raise fastapi.HTTPException(status_code=400, detail="Invalid JSON provided")
 
-    Args:
-        file_data (bytes): The data of the file to be uploaded.
-        file_name (str): The name of the file to be uploaded.
-        mime_type (str): The MIME type of the file to be uploaded.
 
-    Returns:
-        dict: The JSON content of the response.
+async def read_webhook_events(request: fastapi.Request) -> list[WamBase | WamStatus]:
     """
-    files: dict = {
-        "file": (file_name, file_data, mime_type),
-        "type": (None, "application/json"),
-        "messaging_product": (None, "whatsapp"),
-    }
-    endpoint: str = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/media"
-    return await _post_httpx_request(endpoint, files=files)
+    FastAPI dependency parsing the webhook request with `parse_webhook_body`.
 
+    Raises:
+        fastapi.HTTPException: 403 for an invalid signature, 400 for invalid JSON,
+            404 if the request carries no WhatsApp messages or statuses.
+    """
+    raw = await read_webhook_body(request)
+    try:
+        with _metrics.timer("webhook_parse"):
+            events = parse_webhook_body(raw)
+    except ValueError:
+        logging.error("Failed to decode JSON")
+        _metrics.inc("whatsapp_webhook_rejected_total", reason="invalid_json")
+        raise fastapi.HTTPException(status_code=400, detail="Invalid JSON provided")
+    if not events:
+        _metrics.inc("whatsapp_webhook_rejected_total", reason="no_events")
+        raise fastapi.HTTPException(status_code=404, detail="Not a WhatsApp API event")
+    if _metrics.enabled:
+        for event in events:
+            kind = "status" if isinstance(event, WamStatus) else event.message_type
+            _metrics.inc("whatsapp_webhook_events_total", type=kind)
+    return events
 
-async def send_pdf(
-    recipient_id: str, file_data: bytes, file_name: str, mime_type: str
-) -> dict:
+
+def dedup_key(event: WamBase | WamStatus) -> str:
     """
-    Sends a PDF file to the specified recipient on WhatsApp.
+    Return the key identifying a webhook item across redeliveries.
 
-    Args:
-        recipient_id (str): The ID of the recipient to send the PDF to.
-        file_data (bytes): The binary content of the PDF file.
-        file_name (str): The name of the PDF file.
-        mime_type (str): The MIME type of the file, should be 'application/pdf'.
+    Messages are identified by their wamid. A sent message receives several status
+    updates for the same wamid, so statuses are keyed by wamid and status.
+    """
+    if isinstance(event, WamStatus):
+        return f"{event.wamid}:{event.status}"
+    return event.wamid
 
-    Returns:
-        dict: The JSON content of the response from the WhatsApp API.
+
+class DedupStore(ABC):
     """
-    media_id = (await _upload_media(file_data, file_name, mime_type))["id"]
-    data = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": recipient_id,
-        "type": "document",
-        "document": {"filename": file_name, "id": media_id},
+    Interface for stores that remember which webhook items were already handled.
+
+    Implement `add` on top of a shared store (e.g. Redis `SET NX EX`) to
+    deduplicate across several workers or processes.
+    """
+
+    @abstractmethod
+    async def add(self, key: str) -> bool:
+        """
+        Record the key.
+
+        Returns:
+            bool: True if the key was not seen before, False for a duplicate.
+        """
+
+
+class InMemoryDedupStore(DedupStore):
+    """
+    A process-local DedupStore bounded by size (LRU) and age (TTL).
+
+    Args:
+        max_size (int): Maximum number of keys kept. The least recently seen keys
+            are evicted first. Defaults to 100,000.
+        ttl (float): Seconds a key is remembered. Meta retries failed deliveries
+            for up to a few days, hence the default of 3 days.
+    """
+
+    def __init__(self, max_size: int = 100_000, ttl: float = 3 * 24 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._expiries: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    async def add(self, key: str) -> bool:
+        now = time.monotonic()
+        expiry = self._expiries.get(key)
+        if expiry is not None and expiry > now:
+            self._expiries.move_to_end(key)
+            return False
+        self._expiries[key] = now + self.ttl
+        self._expiries.move_to_end(key)
+        while len(self._expiries) > self.max_size:
+            self._expiries.popitem(last=False)
+        return True
+
+
+async def drop_duplicates(
+    events: list[WamBase | WamStatus], dedup: DedupStore
+) -> list[WamBase | WamStatus]:
+    """Return the events that `dedup` has not seen before, recording them."""
+    return [e for e in events if await dedup.add(dedup_key(e))]
+
+
+async def parse_webhook_events(
+    body: _models.WebhookRequestData, dedup: DedupStore | None = None
+) -> list[WamBase | WamStatus]:
+    """
+    Parse all statuses and messages of the webhook request data.
+
+    Items already seen by `dedup` are dropped, so redelivered webhooks do not
+    trigger replies again. Media is not downloaded here, handlers that need the
+    content load it on demand with `WamMediaType.read`, `iter_bytes` or `save`.
+
+    Args:
+        body (WebhookRequestData): The incoming webhook request data.
+        dedup (DedupStore, optional): Store used to skip redelivered items.
+
+    Returns:
+        list[WamBase | WamStatus]: The parsed events in the order they were received.
+    """
+    events = list(iter_webhook_events(body))
+    if dedup is not None:
+        events = await drop_duplicates(events, dedup)
+    return events
+
+
+async def parse_whatsapp_message(body: _models.WebhookRequestData) -> WamBase:
+    """
+    Parse the incoming webhook request data and return an instance of WamBase or WamMediaType.
+
+    This function extracts the necessary information from the webhook request data to
+    instantiate and return a WamBase dataclass object for text messages, a WamMediaType
+    dataclass object for media messages (audio, document, image, sticker, video) or
+    the dataclass registered for other message types, see `register_message_type`.
+    Messages without a registered parser are returned as WamUnknown. Only the
+    first message of the payload is returned, use `parse_webhook_events` to parse
+    a whole batch. The content of media messages is loaded lazily, see
+    `WamMediaType.read`.
+
+    Args:
+        body (WebhookRequestData): The incoming webhook request data.
+
+    Returns:
+        WamBase: An instance of WamBase for text messages.
+        WamMediaType: An instance of WamMediaType for media messages.
+    """
+    return next(e for e in iter_webhook_events(body) if isinstance(e, WamBase))
+
+
+def text_payload(message: str) -> dict:
+    """Build the recipient-independent part of a text message."""
+    return {"type": "text", "text": {"preview_url": False, "body": message}}
+
+
+def quick_reply_payload(message: str, buttons: list[str]) -> dict:
+    """Build the recipient-independent part of a quick reply message with buttons."""
+    btns = [
+        {"type": "reply", "reply": {"id": f"choice{idx+1}", "title": b}}
+        for idx, b in enumerate(buttons)
+    ]
+    return {
+        "type": "interactive",
+        "interactive": {
+            "type": "button",
+            "body": {"text": message},
+            "action": {"buttons": btns},
+        },
+    }
+
+
+def media_payload(
+    media_id: str,
+    media_type: str,
+    *,
+    filename: str | None = None,
+    caption: str | None = None,
+) -> dict:
+    """Build the recipient-independent part of a message with uploaded media."""
+    media: dict = {"id": media_id}
+    if filename is not None:
+        media["filename"] = filename
+    if caption is not None:
+        media["caption"] = caption
+    return {"type": media_type, media_type: media}
+
+
+def _message_data(recipient_id: str, payload: dict) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient_id,
+        **payload,
     }
-    endpoint = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    return await _post_httpx_request(endpoint, data=data)
+
+
+MediaSource = (
+    bytes
+    | bytearray
+    | memoryview
+    | str
+    | os.PathLike
+    | IO[bytes]
+    | AsyncIterable[bytes]
+)
+"""Media content to upload: bytes, a file path, a binary file object or an async
+iterator of byte chunks."""
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass(slots=True)
+class _MediaContent:
+    """
+    Media content opened for a streamed upload.
+
+    Args:
+        chunks (Callable): Returns an async iterator over the content, once per
+            attempt for replayable content.
+        size (int, optional): The content length, if known up front.
+        replayable (bool): Whether `chunks` can be called more than once.
+        path (Path, optional): The file the content is read from, if any.
+        data (memoryview, optional): The content, if it is already in memory.
+        name (str, optional): A file name derived from the source.
+    """
+
+    chunks: Callable[[], AsyncIterator[bytes]]
+    size: int | None
+    replayable: bool
+    path: Path | None = None
+    data: memoryview | None = None
+    name: str | None = None
+
+    async def sha256(self) -> str | None:
+        """Return the hex sha256 of in-memory or file content, None for streams."""
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        if self.path is not None:
+            return await asyncio.to_thread(_file_sha256, self.path)
+        return None
+
+
+def _guess_mime_type(file_name: str) -> str:
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+
+def _file_sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _open_media(
+    source: MediaSource, size: int | None = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> _MediaContent:
+    """
+    Prepare media content for a streamed upload without reading it into memory.
+
+    Files given by path are memory-mapped and sent in chunks, so their pages come
+    from the page cache instead of being copied into one large buffer. Seekable
+    file objects are read in chunks and rewound for every attempt. Async
+    iterators are consumed as they are, which means they cannot be retried.
+
+    Args:
+        source (MediaSource): The content to upload.
+        size (int, optional): The content length for sources of unknown size.
+        chunk_size (int): The size of the chunks read from files.
+
+    Returns:
+        _MediaContent: The opened content.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source).cast("B")
+
+        async def memory_chunks() -> AsyncIterator[bytes]:
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset : offset + chunk_size]
+
+        return _MediaContent(memory_chunks, len(data), True, data=data)
+
+    if isinstance(source, (str, os.PathLike)):
+        path = Path(source)
+        file_size = path.stat().st_size
+
+        async def file_chunks() -> AsyncIterator[bytes]:
+            if file_size == 0:
+                return
+            with open(path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                for offset in range(0, len(mapped), chunk_size):
+                    # slicing copies one chunk at a time out of the mapping
+                    yield mapped[offset : offset + chunk_size]
+
+        return _MediaContent(file_chunks, file_size, True, path=path, name=path.name)
+
+    if hasattr(source, "read"):
+        seekable = source.seekable() if hasattr(source, "seekable") else False
+        start = source.tell() if seekable else 0
+        if size is None and seekable:
+            size = source.seek(0, os.SEEK_END) - start
+            source.seek(start)
+        name = getattr(source, "name", None)
+
+        async def reader_chunks() -> AsyncIterator[bytes]:
+            if seekable:
+                source.seek(start)
+            while chunk := source.read(chunk_size):
+                yield chunk
+
+        return _MediaContent(
+            reader_chunks,
+            size,
+            seekable,
+            name=Path(name).name if isinstance(name, str) else None,
+        )
+
+    if hasattr(source, "__aiter__"):
+        consumed = False
+
+        def stream_chunks() -> AsyncIterator[bytes]:
+            nonlocal consumed
+            if consumed:
+                raise RuntimeError("An async iterator can only be uploaded once.")
+            consumed = True
+            return aiter(source)
+
+        return _MediaContent(stream_chunks, size, False)
+
+    raise TypeError(f"Cannot upload media from {type(source).__name__}.")
+
+
+def _multipart_upload(
+    content: _MediaContent, file_name: str, mime_type: str
+) -> tuple[dict[str, str], Callable[[], AsyncIterator[bytes]]]:
+    """
+    Build a streamed multipart/form-data body for the Graph API media endpoint.
+
+    Returns:
+        tuple[dict, Callable]: The Content-Type (and Content-Length, if the size is
+            known) headers, and a function creating the body chunks.
+    """
+    boundary = uuid.uuid4().hex
+    quoted = re.sub(r"[\r\n]", "", file_name).replace('"', "%22")
+    head = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="messaging_product"\r\n\r\n'
+        "whatsapp\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="type"\r\n\r\n'
+        f"{mime_type}\r\n"
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{quoted}"\r\n'
+        f"Content-Type: {mime_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    if content.size is not None:
+        headers["Content-Length"] = str(len(head) + content.size + len(tail))
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in content.chunks():
+            yield chunk
+        yield tail
+
+    return headers, body
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket limiting how many operations start per second.
+
+    Args:
+        rate (float): Tokens added per second, i.e. the sustained rate.
+        capacity (float, optional): Maximum burst size. Defaults to `rate`.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until `tokens` are available and take them."""
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+
+@dataclass
+class BulkResult:
+    """The outcome of sending to one recipient of `WhatsAppClient.send_bulk`."""
+
+    recipient_id: str
+    response: dict | None
+    error: Exception | None
+    completed: int
+    total: int
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# Graph API error codes signalling that a request was rejected due to throttling
+THROTTLING_ERROR_CODES = frozenset({4, 80007, 130429, 131056})
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of the requests made, so retries cannot multiply
+    load on an API that is already struggling.
+
+    Every request deposits `ratio` tokens, every retry withdraws one.
+
+    Args:
+        ratio (float): Retries allowed per request. Defaults to 0.2.
+        initial_tokens (float): Retries available before any traffic was sent.
+            Defaults to 10.
+        max_tokens (float): The maximum balance. Defaults to 100.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, initial_tokens: float = 10, max_tokens: float = 100
+    ):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = initial_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a Graph API request.
+
+    Retries use exponential backoff with full jitter and honor `Retry-After`.
+    Requests that are safe to repeat (downloads, lookups, uploads) are retried on
+    connection errors, timeouts, throttling and 5xx responses. Message sends are
+    only retried when the API provably did not process them, i.e. the connection
+    could not be established or the request was rejected due to throttling, so a
+    retry never delivers a message twice.
+
+    Args:
+        max_attempts (int): Maximum attempts including the first. 1 disables retries.
+        base_delay (float): Backoff base in seconds.
+        max_delay (float): Upper bound for a single wait in seconds.
+        retry_statuses (frozenset): HTTP statuses retried for idempotent requests.
+        throttling_codes (frozenset): Graph API error codes signalling throttling.
+        budget (RetryBudget): Budget shared by all requests of a client.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30
+    retry_statuses: frozenset = frozenset({408, 429, 500, 502, 503, 504})
+    throttling_codes: frozenset = THROTTLING_ERROR_CODES
+    budget: RetryBudget = field(default_factory=RetryBudget)
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Return the seconds to wait before retry number `attempt` (0-based)."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def is_throttled(self, response: httpx.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        try:
+            code = response.json().get("error", {}).get("code")
+        except (ValueError, AttributeError):
+            return False
+        return code in self.throttling_codes
+
+    def should_retry(
+        self,
+        attempt: int,
+        idempotent: bool,
+        response: httpx.Response | None = None,
+        error: Exception | None = None,
+    ) -> bool:
+        """Decide whether a failed attempt is retried, withdrawing from the budget."""
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if error is not None:
+            # the request never reached the server, so it is always safe to repeat
+            retryable = isinstance(
+                error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+            ) or (idempotent and isinstance(error, httpx.TransportError))
+        elif response is not None:
+            retryable = self.is_throttled(response) or (
+                idempotent and response.status_code in self.retry_statuses
+            )
+        else:
+            retryable = False
+        return retryable and self.budget.withdraw()
+
+
+def _graph_error_code(response: httpx.Response) -> str:
+    """Return the Graph API error code of an error response, or an empty string."""
+    if response.is_success:
+        return ""
+    try:
+        return str(response.json()["error"]["code"])
+    except (ValueError, KeyError, TypeError):
+        return ""
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Parse the Retry-After header, given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the Graph API while the circuit breaker is open.
+
+    Attributes:
+        retry_after (float): Seconds until the breaker lets a probe request through.
+            Callers can use it to defer the work instead of dropping it.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling the Graph API while it is failing or slow.
+
+    The breaker tracks the outcome of the last `window` calls. Once at least
+    `min_calls` were made and the share of failed calls (connection errors, 5xx,
+    throttling) or of calls slower than `slow_call_duration` crosses its threshold,
+    the breaker opens and calls fail fast with CircuitOpenError. After
+    `open_duration` seconds it is half-open and lets `half_open_probes` calls
+    through: if they succeed it closes, otherwise it opens again.
+
+    Args:
+        failure_rate (float): Share of failed calls that opens the breaker.
+        slow_call_rate (float): Share of slow calls that opens the breaker.
+        slow_call_duration (float): Seconds after which a call counts as slow.
+        window (int): Number of recent calls considered.
+        min_calls (int): Calls required in the window before the breaker can open.
+        open_duration (float): Seconds the breaker stays open before probing.
+        half_open_probes (int): Calls let through while half-open.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_rate: float = 0.5,
+        slow_call_rate: float = 0.8,
+        slow_call_duration: float = 5,
+        window: int = 50,
+        min_calls: int = 20,
+        open_duration: float = 30,
+        half_open_probes: int = 1,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.min_calls = min_calls
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.state = "closed"
+        self._calls: deque[tuple[bool, bool]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def before_call(self) -> None:
+        """
+        Check whether a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the breaker is open or all probes are in flight.
+        """
+        if self.state == "open":
+            remaining = self._opened_at + self.open_duration - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            self.state = "half_open"
+            self._probes = self._probe_successes = 0
+        if self.state == "half_open":
+            if self._probes >= self.half_open_probes:
+                raise CircuitOpenError(0)
+            self._probes += 1
+
+    def record(self, success: bool, duration: float) -> None:
+        """Record the outcome of a call that was let through."""
+        if self.state == "half_open":
+            if not success:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                logging.info("Circuit breaker closed.")
+                self.state = "closed"
+                self._calls.clear()
+            return
+        if self.state == "open":
+            return
+
+        self._calls.append((success, duration >= self.slow_call_duration))
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(not ok for ok, _ in self._calls) / len(self._calls)
+        slow = sum(slow for _, slow in self._calls) / len(self._calls)
+        if failures >= self.failure_rate or slow >= self.slow_call_rate:
+            self._open()
+
+    def _open(self) -> None:
+        logging.warning(f"Circuit breaker opened for {self.open_duration}s.")
+        self.state = "open"
+        self._opened_at = time.monotonic()
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of requests in flight, adapting the limit AIMD-style.
+
+    Each call within `latency_target` that was not throttled raises the limit by
+    1/limit (about +1 per round of calls). Throttled, failed or slow calls
+    multiply it by `backoff`, at most once per `cooldown` seconds, so a burst of
+    429s shrinks the limit once instead of collapsing it to the minimum.
+
+    Args:
+        initial_limit (float, optional): The starting limit. Defaults to `max_limit`.
+        min_limit (int): The lowest the limit shrinks to.
+        max_limit (int): The highest the limit grows to.
+        latency_target (float): Seconds above which a call counts as slow.
+        backoff (float): Factor applied to the limit on overload.
+        cooldown (float): Minimum seconds between two decreases.
+    """
+
+    def __init__(
+        self,
+        *,
+        initial_limit: float | None = None,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_target: float = 2,
+        backoff: float = 0.5,
+        cooldown: float = 1,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit if initial_limit is not None else max_limit)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._decreased_at = float("-inf")
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        """Wait for a free slot below the current limit."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        """Free the slot and adapt the limit to the outcome of the call."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if overloaded or latency > self.latency_target:
+            if now - self._decreased_at >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased_at = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+@dataclass
+class MediaInfo:
+    """Metadata of an uploaded media file as returned by GET /{media_id}."""
+
+    media_id: str
+    url: str
+    mime_type: str
+    file_size: int
+    sha256: str
+    expires_at: float = field(default=0.0, repr=False)
+
+    @classmethod
+    def from_response(cls, media_id: str, r: dict, ttl: float) -> "MediaInfo":
+        expires_at = time.time() + ttl
+        # lookaside URLs carry their own expiry timestamp in the `ext` parameter
+        ext = parse_qs(urlparse(r["url"]).query).get("ext")
+        if ext and ext[0].isdigit():
+            expires_at = min(expires_at, int(ext[0]))
+        return cls(
+            media_id=r.get("id", media_id),
+            url=r["url"],
+            mime_type=r.get("mime_type", ""),
+            file_size=int(r.get("file_size", 0)),
+            sha256=r.get("sha256", ""),
+            expires_at=expires_at,
+        )
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+
+class WhatsAppClient:
+    """
+    A long-lived client for the WhatsApp Cloud (Graph) API.
+
+    The client keeps a single pooled httpx.AsyncClient open so that consecutive
+    calls reuse TCP+TLS connections to graph.facebook.com instead of paying a
+    fresh handshake per request. Create one instance per process, call `start`
+    on startup and `aclose` on shutdown (or use it as an async context manager).
+
+    Args:
+        token (str, optional): The bearer token used to authenticate against the
+            Graph API. Defaults to the token of `settings`.
+        phone_number_id (str, optional): The ID of the phone number messages are
+            sent from. Defaults to the phone number of `settings`.
+        api_version (str, optional): The Graph API version, e.g. "v18.0".
+        settings (Settings, optional): Where missing credentials are taken from.
+            Defaults to the process-wide settings, see `get_settings`.
+        base_url (str, optional): The Graph API base URL. Defaults to the
+            `graph_url` of the settings.
+        timeout (float): Timeout in seconds for every request. Defaults to 10.
+        max_connections (int): Maximum number of concurrent connections in the pool.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive.
+        keepalive_expiry (float): Seconds an idle connection is kept alive.
+        http2 (bool): Use HTTP/2 if available. Requires the `h2` package.
+        transport (httpx.AsyncBaseTransport, optional): A custom transport, e.g. for tests.
+        media_info_ttl (float): Seconds resolved media URLs are cached. Download URLs
+            are only valid for 5 minutes, so this is capped at the URL's own expiry.
+        media_info_cache_size (int): Maximum number of cached media URLs.
+        media_cache_dir (str | os.PathLike, optional): Directory in which downloaded
+            media is cached by its sha256, so repeated downloads are read from disk.
+        media_upload_ttl (float): Seconds an uploaded media_id is reused for the same
+            content. WhatsApp keeps uploaded media for 30 days, defaults to 29 days.
+        media_upload_cache_size (int): Maximum number of remembered uploads.
+        retry_policy (RetryPolicy, optional): How failed requests are retried.
+            Pass `RetryPolicy(max_attempts=1)` to disable retries.
+        circuit_breaker (CircuitBreaker, optional): Fails calls fast while the Graph
+            API is degraded.
+        concurrency_limiter (AdaptiveConcurrencyLimiter, optional): Adapts the number
+            of requests in flight to the observed latency and throttling. Defaults
+            to a limiter capped at `max_connections`.
+        outbox (OutboxBackend, optional): Durable queue that sends with
+            `durable=True` are written to. Drain it with an OutboxDispatcher.
+        messages_per_second (float, optional): Maximum rate of messages sent
+            right away, matching the throughput tier of the phone number.
+            Unlimited by default.
+    """
+
+    base_url = GRAPH_URL
+
+    def __init__(
+        self,
+        token: str | None = None,
+        phone_number_id: str | None = None,
+        api_version: str | None = None,
+        *,
+        settings: Settings | None = None,
+        base_url: str | None = None,
+        timeout: float = 10,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        http2: bool = False,
+        transport: httpx.AsyncBaseTransport | None = None,
+        media_info_ttl: float = 4 * 60,
+        media_info_cache_size: int = 10_000,
+        media_cache_dir: str | os.PathLike | None = None,
+        media_upload_ttl: float = 29 * 24 * 3600,
+        media_upload_cache_size: int = 1000,
+        retry_policy: RetryPolicy | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        concurrency_limiter: AdaptiveConcurrencyLimiter | None = None,
+        outbox: "OutboxBackend | None" = None,
+        messages_per_second: float | None = None,
+    ):
+        if token is None or phone_number_id is None or api_version is None:
+            settings = settings or get_settings()
+            token = token if token is not None else settings.require("token")
+            if phone_number_id is None:
+                phone_number_id = settings.require("phone_number_id")
+            api_version = api_version or settings.api_version
+        if base_url is None and settings is not None:
+            base_url = settings.graph_url
+        if base_url is not None:
+            self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.phone_number_id = phone_number_id
+        self.api_version = api_version
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.transport = transport
+        self.media_info_ttl = media_info_ttl
+        self.media_info_cache_size = media_info_cache_size
+        self.media_cache_dir = Path(media_cache_dir) if media_cache_dir else None
+        self._client: httpx.AsyncClient | None = None
+        self._media_infos: OrderedDict[str, MediaInfo] = OrderedDict()
+        self.media_upload_ttl = media_upload_ttl
+        self.media_upload_cache_size = media_upload_cache_size
+        self._uploads: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._pending_uploads: dict[str, asyncio.Future] = {}
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.concurrency_limiter = concurrency_limiter or AdaptiveConcurrencyLimiter(
+            max_limit=max_connections
+        )
+        self.outbox = outbox
+        self.rate_limiter = (
+            TokenBucket(messages_per_second) if messages_per_second else None
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The underlying pooled httpx.AsyncClient, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self.transport,
+            )
+        return self._client
+
+    @property
+    def messages_url(self) -> str:
+        return f"{self.base_url}/{self.api_version}/{self.phone_number_id}/messages"
+
+    @property
+    def media_url(self) -> str:
+        return f"{self.base_url}/{self.api_version}/{self.phone_number_id}/media"
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def start(self) -> "WhatsAppClient":
+        """Open the connection pool. Safe to call more than once."""
+        self.client  # creates the pooled httpx.AsyncClient
+        return self
+
+    async def aclose(self) -> None:
+        """Close the connection pool and release all connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "WhatsAppClient":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def _attempt(self, request: httpx.Request, stream: bool) -> httpx.Response:
+        """
+        Send a single attempt through the circuit breaker and concurrency limiter.
+
+        Error responses are read and closed before they are returned.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+        """
+        self.circuit_breaker.before_call()
+        await self.concurrency_limiter.acquire()
+        start = time.monotonic()
+        overloaded = True
+        try:
+            response = await self.client.send(request, stream=stream)
+            if not response.is_success:
+                await response.aread()
+                await response.aclose()
+            overloaded = not response.is_success and (
+                response.status_code >= 500 or self.retry_policy.is_throttled(response)
+            )
+            if _metrics.enabled:
+                _metrics.inc(
+                    "whatsapp_graph_responses_total",
+                    status=str(response.status_code),
+                    code=_graph_error_code(response),
+                )
+            return response
+        except httpx.TransportError as e:
+            _metrics.inc(
+                "whatsapp_graph_responses_total", status="error", code=type(e).__name__
+            )
+            raise
+        finally:
+            latency = time.monotonic() - start
+            self.circuit_breaker.record(not overloaded, latency)
+            self.concurrency_limiter.release(latency, overloaded)
+            _metrics.observe(
+                "whatsapp_graph_request_seconds", latency, method=request.method
+            )
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        *,
+        idempotent: bool,
+        stream: bool = False,
+        content: Callable[[], AsyncIterator[bytes]] | None = None,
+        replayable: bool = True,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send a request, retrying it according to the retry policy.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL to send the request to.
+            idempotent (bool): Whether repeating the request is harmless.
+            stream (bool): Return without reading the body. The caller must close
+                the response.
+            content (Callable, optional): Creates the streamed request body, called
+                once per attempt so every retry sends the body from the start.
+            replayable (bool): Whether the body can be sent more than once. Requests
+                with a body that cannot be replayed are never retried.
+            **kwargs: Passed on to httpx.AsyncClient.build_request.
+
+        Returns:
+            httpx.Response: The successful response.
+
+        Raises:
+            httpx.HTTPStatusError: If the final attempt got an error response.
+            httpx.TransportError: If the final attempt failed to connect or read.
+        """
+        policy = self.retry_policy
+        policy.budget.deposit()
+        attempt = 0
+        while True:
+            if content is not None:
+                kwargs["content"] = content()
+            request = self.client.build_request(method, url, **kwargs)
+            try:
+                response = await self._attempt(request, stream=stream)
+            except httpx.TransportError as e:
+                if not replayable or not policy.should_retry(
+                    attempt, idempotent, error=e
+                ):
+                    raise
+                delay = policy.backoff(attempt)
+                reason = repr(e)
+            else:
+                if response.is_success:
+                    return response
+                if not replayable or not policy.should_retry(
+                    attempt, idempotent, response=response
+                ):
+                    response.raise_for_status()
+                delay = policy.backoff(attempt, _retry_after(response))
+                reason = f"HTTP {response.status_code}"
+            logging.warning(
+                f"{method} {request.url.path} failed ({reason}), "
+                f"retrying in {delay:.2f}s.",
+                extra={"category": "retry"},
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_media_info(self, media_id: str) -> MediaInfo:
+        """
+        Resolve the metadata and download URL of the media with the given media_id.
+
+        Results are cached until the download URL expires, so repeated access to the
+        same media skips the lookup.
+
+        Args:
+            media_id (str): The ID of the media file.
+
+        Returns:
+            MediaInfo: The URL, MIME type, size and sha256 of the media file.
+        """
+        info = self._media_infos.get(media_id)
+        if info is not None and not info.expired:
+            self._media_infos.move_to_end(media_id)
+            _metrics.inc("whatsapp_media_info_cache_total", result="hit")
+            return info
+
+        _metrics.inc("whatsapp_media_info_cache_total", result="miss")
+        endpoint = f"{self.base_url}/{self.api_version}/{media_id}"
+        with _metrics.timer("media_info"):
+            response = await self._send(
+                "GET", endpoint, idempotent=True, headers=self.headers
+            )
+        info = MediaInfo.from_response(
+            media_id, response.json(), ttl=self.media_info_ttl
+        )
+
+        self._media_infos[media_id] = info
+        self._media_infos.move_to_end(media_id)
+        while len(self._media_infos) > self.media_info_cache_size:
+            self._media_infos.popitem(last=False)
+        return info
+
+    async def _get_media_url(self, media_id: str) -> str:
+        return (await self.get_media_info(media_id)).url
+
+    def _media_cache_path(self, sha256: str | None) -> Path | None:
+        """Return the path of the cached content with the given sha256, if any."""
+        if self.media_cache_dir is None or not sha256:
+            return None
+        try:
+            name = base64.b64decode(sha256, validate=True).hex()
+        except ValueError:
+            return None
+        return self.media_cache_dir / name
+
+    async def _download_media(self, media_id: str, sha256: str | None = None) -> bytes:
+        """
+        Download media from the given media_id.
+
+        This function uses the media_id to construct a URL to the media file,
+        sends a GET request to that URL, and returns the content of the response.
+        If the media file cannot be found or accessed, an HTTP error is raised.
+
+        Args:
+            media_id (str): The ID of the media file to download.
+            sha256 (str, optional): The base64 sha256 of the media from the webhook.
+                Lets cached content be served without resolving the URL.
+
+        Returns:
+            bytes: The content of the media file.
+        """
+        chunks = [c async for c in self.stream_media(media_id, sha256=sha256)]
+        return b"".join(chunks)
+
+    async def stream_media(
+        self,
+        media_id: str,
+        chunk_size: int = 64 * 1024,
+        sha256: str | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream media from the given media_id in chunks.
+
+        With a `media_cache_dir` the content is written to the cache while it is
+        streamed and served from disk on subsequent calls.
+
+        Args:
+            media_id (str): The ID of the media file to download.
+            chunk_size (int): The size of the chunks in bytes. Defaults to 64 KiB.
+            sha256 (str, optional): The base64 sha256 of the media from the webhook.
+
+        Yields:
+            bytes: The next chunk of the media file.
+        """
+        cached = self._media_cache_path(sha256)
+        if cached is None or not cached.exists():
+            info = await self.get_media_info(media_id)
+            cached = self._media_cache_path(info.sha256 or sha256)
+        if cached is not None and cached.exists():
+            with open(cached, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    _metrics.inc(
+                        "whatsapp_media_download_bytes_total",
+                        len(chunk),
+                        source="cache",
+                    )
+                    yield chunk
+            return
+
+        with _metrics.timer("media_download"):
+            try:
+                response = await self._send(
+                    "GET", info.url, idempotent=True, stream=True, headers=self.headers
+                )
+            except httpx.HTTPStatusError:
+                # the URL may have expired early, resolve it again next time
+                self._media_infos.pop(media_id, None)
+                raise
+            try:
+                chunks = response.aiter_bytes(chunk_size)
+                if cached is not None:
+                    chunks = self._tee_to_cache(chunks, cached)
+                async for chunk in chunks:
+                    _metrics.inc(
+                        "whatsapp_media_download_bytes_total",
+                        len(chunk),
+                        source="graph",
+                    )
+                    yield chunk
+            finally:
+                await response.aclose()
+
+    async def _tee_to_cache(
+        self, chunks: AsyncIterator[bytes], path: Path
+    ) -> AsyncIterator[bytes]:
+        """Yield the chunks while writing them to `path` if their sha256 matches."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{id(chunks)}.part")
+        try:
+            with open(tmp, "wb") as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    yield chunk
+            if digest.hexdigest() == path.name:
+                os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    async def _post_httpx_request(
+        self, url: str, data: dict | None = None, files: dict | None = None
+    ) -> dict:
+        """
+        Send a POST request to the given URL with the provided data and files.
+
+        This function constructs a POST request with the given data and files,
+        sends the request to the given URL, and returns the JSON content of the response.
+        If the response contains more than one contact or message, a ValueError is raised.
+
+        Args:
+            url (str): The URL to send the POST request to.
+            data (dict, optional): The data to include in the request body. Defaults to None.
+            files (dict, optional): The files to include in the request body. Defaults to None.
+
+        Returns:
+            dict: The JSON content of the response.
+        """
+        headers = self.headers
+        if data:
+            headers["Content-Type"] = "application/json"
+        # only uploads are safe to repeat, a repeated send could deliver twice
+        with _metrics.timer("upload" if files is not None else "send"):
+            response = await self._send(
+                "POST",
+                url,
+                idempotent=files is not None,
+                json=data,
+                headers=headers,
+                files=files,
+            )
+
+        r = response.json()
+        if data and (
+            "contacts" in r
+            and len(r["contacts"]) > 1
+            or "messages" in r
+            and len(r["messages"]) > 1
+        ):
+            raise ValueError(
+                "Expected only one contact and one message in the response."
+            )
+
+        return r
+
+    async def _deliver(
+        self, data: dict, durable: bool, idempotency_id: str | None
+    ) -> dict:
+        """Send the message now, or hand it to the outbox if `durable` is set."""
+        if not durable:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            return await self._post_httpx_request(self.messages_url, data=data)
+        if self.outbox is None:
+            raise ValueError("Durable sends require a client with an outbox.")
+        idempotency_id = idempotency_id or uuid.uuid4().hex
+        queued = await self.outbox.put(idempotency_id, data)
+        return {"idempotency_id": idempotency_id, "queued": queued}
+
+    async def send_message(
+        self,
+        recipient_id: str,
+        message: str,
+        *,
+        durable: bool = False,
+        idempotency_id: str | None = None,
+    ) -> dict:
+        """
+        Send a text message to the recipient.
+
+        Args:
+            recipient_id (str): The ID of the recipient to send the message to.
+            message (str): The message to send.
+            durable (bool): Enqueue the message into the client's outbox instead of
+                sending it right away. Defaults to False.
+            idempotency_id (str, optional): Identifies a durable message, enqueueing
+                the same ID twice is a no-op. Defaults to a random ID.
+
+        Returns:
+            dict: The JSON content of the response, or the idempotency_id and
+                whether the message was queued for durable sends.
+        """
+        data = _message_data(recipient_id, text_payload(message))
+        return await self._deliver(data, durable, idempotency_id)
+
+    async def send_quick_reply_message(
+        self,
+        recipient_id: str,
+        message: str,
+        buttons: list[str],
+        *,
+        durable: bool = False,
+        idempotency_id: str | None = None,
+    ) -> dict:
+        """
+        Send a quick reply message with buttons to the recipient.
+
+        Args:
+            recipient_id (str): The ID of the recipient to send the message to.
+            message (str): The message to send.
+            buttons (list[str]): A list of button titles for quick replies.
+            durable (bool): Enqueue the message into the outbox, see `send_message`.
+            idempotency_id (str, optional): Identifies a durable message.
+
+        Returns:
+            dict: The JSON content of the response.
+        """
+        data = _message_data(recipient_id, quick_reply_payload(message, buttons))
+        return await self._deliver(data, durable, idempotency_id)
+
+    async def _upload_media(
+        self,
+        source: MediaSource,
+        file_name: str | None = None,
+        mime_type: str | None = None,
+        *,
+        size: int | None = None,
+        content: _MediaContent | None = None,
+    ) -> dict:
+        """
+        Uploads a media file to the server, streaming the multipart body.
+
+        Args:
+            source (MediaSource): The content to upload: bytes, a file path, a binary
+                file object or an async iterator of byte chunks.
+            file_name (str, optional): The name of the file. Defaults to the name of
+                the file the source is read from.
+            mime_type (str, optional): The MIME type of the file. Defaults to the
+                type guessed from the file name.
+            size (int, optional): The content length of async iterators, sent as
+                Content-Length instead of a chunked body.
+            content (_MediaContent, optional): The already opened source.
+
+        Returns:
+            dict: The JSON content of the response.
+        """
+        content = content or _open_media(source, size)
+        file_name = file_name or content.name
+        if not file_name:
+            raise ValueError("A file_name is required for this media source.")
+        mime_type = mime_type or _guess_mime_type(file_name)
+        headers, body = _multipart_upload(content, file_name, mime_type)
+        with _metrics.timer("upload"):
+            response = await self._send(
+                "POST",
+                self.media_url,
+                idempotent=True,
+                content=body,
+                replayable=content.replayable,
+                headers={**self.headers, **headers},
+            )
+        return response.json()
+
+    async def upload_media(
+        self,
+        source: MediaSource,
+        file_name: str | None = None,
+        mime_type: str | None = None,
+        *,
+        size: int | None = None,
+    ) -> str:
+        """
+        Upload a media file once and return its media_id.
+
+        The file is streamed to the Graph API, so local files and async iterators
+        are never held in memory as a whole. Uploads of bytes and file paths are
+        cached by the sha256 of the content and the MIME type, so sending the same
+        file to many recipients uploads it only once. Concurrent uploads of the
+        same content share a single request. File objects and async iterators are
+        uploaded every time. Call this at startup to pre-upload assets and send
+        them with `send_media_by_id`.
+
+        Args:
+            source (MediaSource): The content to upload, see `_upload_media`.
+            file_name (str, optional): The name of the file.
+            mime_type (str, optional): The MIME type of the file.
+            size (int, optional): The content length of async iterators.
+
+        Returns:
+            str: The media_id of the uploaded file.
+        """
+        content = _open_media(source, size)
+        file_name = file_name or content.name
+        if not file_name:
+            raise ValueError("A file_name is required for this media source.")
+        mime_type = mime_type or _guess_mime_type(file_name)
+        digest = await content.sha256()
+        if digest is None:
+            response = await self._upload_media(
+                source, file_name, mime_type, content=content
+            )
+            return response["id"]
+
+        key = f"{digest}:{mime_type}"
+        cached = self._uploads.get(key)
+        if cached is not None and cached[1] > time.time():
+            self._uploads.move_to_end(key)
+            return cached[0]
+
+        pending = self._pending_uploads.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._pending_uploads[key] = pending
+        try:
+            response = await self._upload_media(
+                source, file_name, mime_type, content=content
+            )
+            media_id = response["id"]
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # mark as retrieved if nobody else is waiting
+            raise
+        except BaseException:
+            pending.cancel()
+            raise
+        else:
+            pending.set_result(media_id)
+        finally:
+            del self._pending_uploads[key]
+
+        self._uploads[key] = (media_id, time.time() + self.media_upload_ttl)
+        while len(self._uploads) > self.media_upload_cache_size:
+            self._uploads.popitem(last=False)
+        return media_id
+
+    async def send_media_by_id(
+        self,
+        recipient_id: str,
+        media_id: str,
+        media_type: str,
+        *,
+        filename: str | None = None,
+        caption: str | None = None,
+        durable: bool = False,
+        idempotency_id: str | None = None,
+    ) -> dict:
+        """
+        Send previously uploaded media to the recipient.
+
+        Args:
+            recipient_id (str): The ID of the recipient to send the media to.
+            media_id (str): The media_id returned by `upload_media`.
+            media_type (str): One of "document", "image", "audio", "video" or "sticker".
+            filename (str, optional): The file name shown for documents.
+            caption (str, optional): A caption for documents, images and videos.
+            durable (bool): Enqueue the message into the outbox, see `send_message`.
+            idempotency_id (str, optional): Identifies a durable message.
+
+        Returns:
+            dict: The JSON content of the response from the WhatsApp API.
+        """
+        payload = media_payload(
+            media_id, media_type, filename=filename, caption=caption
+        )
+        data = _message_data(recipient_id, payload)
+        return await self._deliver(data, durable, idempotency_id)
+
+    async def send_media(
+        self,
+        recipient_id: str,
+        source: MediaSource,
+        media_type: str,
+        *,
+        file_name: str | None = None,
+        mime_type: str | None = None,
+        caption: str | None = None,
+        size: int | None = None,
+        durable: bool = False,
+        idempotency_id: str | None = None,
+    ) -> dict:
+        """
+        Upload media and send it to the recipient.
+
+        The file is streamed to the Graph API and only uploaded the first time it
+        is sent, see `upload_media`. For durable sends the file is uploaded right
+        away and only the message is enqueued into the outbox.
+
+        Args:
+            recipient_id (str): The ID of the recipient to send the media to.
+            source (MediaSource): Bytes, a file path, a binary file object or an
+                async iterator of byte chunks.
+            media_type (str): One of "document", "image", "audio", "video" or "sticker".
+            file_name (str, optional): The name of the file, shown for documents.
+                Defaults to the name of the file the source is read from.
+            mime_type (str, optional): The MIME type. Defaults to the type guessed
+                from the file name.
+            caption (str, optional): A caption for documents, images and videos.
+            size (int, optional): The content length of async iterators.
+            durable (bool): Enqueue the message into the outbox, see `send_message`.
+            idempotency_id (str, optional): Identifies a durable message.
+
+        Returns:
+            dict: The JSON content of the response from the WhatsApp API.
+        """
+        if file_name is None:
+            name = getattr(source, "name", source)
+            if isinstance(name, (str, os.PathLike)):
+                file_name = Path(name).name
+        media_id = await self.upload_media(source, file_name, mime_type, size=size)
+        return await self.send_media_by_id(
+            recipient_id,
+            media_id,
+            media_type,
+            filename=file_name if media_type == "document" else None,
+            caption=caption,
+            durable=durable,
+            idempotency_id=idempotency_id,
+        )
+
+    async def send_document(
+        self, recipient_id: str, source: MediaSource, **kwargs
+    ) -> dict:
+        """Send a document, e.g. a PDF. See `send_media` for the arguments."""
+        return await self.send_media(recipient_id, source, "document", **kwargs)
+
+    async def send_image(
+        self, recipient_id: str, source: MediaSource, **kwargs
+    ) -> dict:
+        """Send an image. See `send_media` for the arguments."""
+        return await self.send_media(recipient_id, source, "image", **kwargs)
+
+    async def send_audio(
+        self, recipient_id: str, source: MediaSource, **kwargs
+    ) -> dict:
+        """Send an audio file, audio messages have no caption. See `send_media`."""
+        return await self.send_media(recipient_id, source, "audio", **kwargs)
+
+    async def send_video(
+        self, recipient_id: str, source: MediaSource, **kwargs
+    ) -> dict:
+        """Send a video. See `send_media` for the arguments."""
+        return await self.send_media(recipient_id, source, "video", **kwargs)
+
+    async def send_pdf(
+        self,
+        recipient_id: str,
+        file_data: MediaSource,
+        file_name: str,
+        mime_type: str,
+        *,
+        durable: bool = False,
+        idempotency_id: str | None = None,
+    ) -> dict:
+        """
+        Sends a PDF file to the specified recipient on WhatsApp.
+
+        Kept for backwards compatibility, see `send_document`.
+
+        Args:
+            recipient_id (str): The ID of the recipient to send the PDF to.
+            file_data (MediaSource): The PDF as bytes, a path, a file object or an
+                async iterator of byte chunks.
+            file_name (str): The name of the PDF file.
+            mime_type (str): The MIME type of the file, should be 'application/pdf'.
+            durable (bool): Enqueue the message into the outbox, see `send_message`.
+            idempotency_id (str, optional): Identifies a durable message.
+
+        Returns:
+            dict: The JSON content of the response from the WhatsApp API.
+        """
+        return await self.send_document(
+            recipient_id,
+            file_data,
+            file_name=file_name,
+            mime_type=mime_type,
+            durable=durable,
+            idempotency_id=idempotency_id,
+        )
+
+    async def send_bulk(
+        self,
+        recipients: Iterable[str],
+        payload: dict,
+        *,
+        concurrency: int = 50,
+        messages_per_second: float = 80,
+    ) -> AsyncIterator[BulkResult]:
+        """
+        Send the same message to many recipients.
+
+        Sends fan out over `concurrency` workers and are started at no more than
+        `messages_per_second`, which should match the throughput tier of the phone
+        number (80 by default for the Cloud API). One BulkResult is yielded per
+        recipient as soon as its send finishes, so iterating doubles as progress
+        reporting. Failed sends are reported in the result instead of raising.
+
+        Args:
+            recipients (Iterable[str]): The IDs of the recipients.
+            payload (dict): The message built with `text_payload`, `quick_reply_payload`
+                or `media_payload`.
+            concurrency (int): Maximum number of requests in flight. Defaults to 50.
+            messages_per_second (float): Maximum send rate. Defaults to 80.
+
+        Yields:
+            BulkResult: The response or error for each recipient.
+        """
+        pending = list(recipients)
+        total = len(pending)
+        todo = iter(pending)
+        limiter = TokenBucket(messages_per_second)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker() -> None:
+            for recipient_id in todo:
+                await limiter.acquire()
+                try:
+                    data = _message_data(recipient_id, payload)
+                    r = await self._post_httpx_request(self.messages_url, data=data)
+                    await results.put((recipient_id, r, None))
+                except Exception as e:
+                    await results.put((recipient_id, None, e))
+
+        workers = [
+            asyncio.create_task(worker()) for _ in range(min(concurrency, total))
+        ]
+        try:
+            for completed in range(1, total + 1):
+                recipient_id, response, error = await results.get()
+                yield BulkResult(recipient_id, response, error, completed, total)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+class UnknownTenantError(KeyError):
+    """Raised when no client is registered for a phone_number_id."""
+
+
+class TenantRegistry:
+    """
+    The WhatsAppClients of all business phone numbers served by this process.
+
+    Every tenant has its own credentials, connection pool, rate limiter, circuit
+    breaker and concurrency limiter, so a throttled or misconfigured number does
+    not slow down the others. Webhook events carry the `phone_number_id` that
+    received them, which `get_client` uses to pick the tenant to reply with.
+
+    Args:
+        clients (Iterable[WhatsAppClient]): The clients to register.
+    """
+
+    def __init__(self, clients: Iterable[WhatsAppClient] = ()):
+        self._clients: dict[str, WhatsAppClient] = {}
+        for client in clients:
+            self.add(client)
+
+    @classmethod
+    def from_config(cls, tenants: Iterable[dict], **client_kwargs) -> "TenantRegistry":
+        """
+        Create a registry from tenant settings.
+
+        Args:
+            tenants (Iterable[dict]): One dict per phone number with the keys
+                "phone_number_id" and "token", and optionally "api_version" and
+                "messages_per_second".
+            **client_kwargs: Passed on to every WhatsAppClient, e.g. pool limits.
+
+        Returns:
+            TenantRegistry: The registry holding a client per tenant.
+        """
+        clients = []
+        for tenant in tenants:
+            options = ("api_version", "messages_per_second")
+            kwargs = client_kwargs | {k: tenant[k] for k in options if k in tenant}
+            clients.append(
+                WhatsAppClient(tenant["token"], tenant["phone_number_id"], **kwargs)
+            )
+        return cls(clients)
+
+    @classmethod
+    def from_file(cls, path: str | os.PathLike, **client_kwargs) -> "TenantRegistry":
+        """Create a registry from a JSON file holding a list of tenant settings."""
+        return cls.from_config(json.loads(Path(path).read_text()), **client_kwargs)
+
+    def add(self, client: WhatsAppClient) -> WhatsAppClient:
+        """Register the client for its phone_number_id, replacing an existing one."""
+        self._clients[client.phone_number_id] = client
+        return client
+
+    def get(self, phone_number_id: str) -> WhatsAppClient:
+        """
+        Return the client of a phone number.
+
+        Raises:
+            UnknownTenantError: If the phone number is not registered.
+        """
+        try:
+            return self._clients[phone_number_id]
+        except KeyError:
+            raise UnknownTenantError(phone_number_id) from None
+
+    def __contains__(self, phone_number_id: object) -> bool:
+        return phone_number_id in self._clients
+
+    def __iter__(self) -> Iterator[WhatsAppClient]:
+        return iter(self._clients.values())
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    async def start(self) -> "TenantRegistry":
+        """Open the connection pools of all tenants."""
+        await asyncio.gather(*(client.start() for client in self))
+        return self
+
+    async def aclose(self) -> None:
+        """Close the connection pools of all tenants."""
+        await asyncio.gather(*(client.aclose() for client in self))
+
+
+_default_client: WhatsAppClient | None = None
+_tenants = TenantRegistry()
+
+
+def get_client(phone_number_id: str | None = None) -> WhatsAppClient:
+    """
+    Return the WhatsAppClient used by the module-level helpers.
+
+    Args:
+        phone_number_id (str, optional): The phone number to send from. Its tenant
+            client is returned if it is registered, see `set_tenants`.
+
+    Returns:
+        WhatsAppClient: The tenant client, or else the process-wide client which
+            is created on first use from the environment configuration.
+
+    Raises:
+        UnknownTenantError: If the phone number is neither a registered tenant nor
+            the number of the process-wide client.
+    """
+    global _default_client
+    if phone_number_id is not None:
+        if phone_number_id in _tenants:
+            return _tenants.get(phone_number_id)
+        default_id = (
+            _default_client.phone_number_id
+            if _default_client is not None
+            else get_settings().phone_number_id
+        )
+        # never reply from another number than the one that was messaged
+        if phone_number_id != default_id:
+            raise UnknownTenantError(phone_number_id)
+    if _default_client is None:
+        _default_client = WhatsAppClient()
+    return _default_client
+
+
+def set_client(client: WhatsAppClient) -> None:
+    """Replace the process-wide WhatsAppClient, e.g. with custom pool limits."""
+    global _default_client
+    _default_client = client
+
+
+def get_tenants() -> TenantRegistry:
+    """Return the registry of tenant clients consulted by `get_client`."""
+    return _tenants
+
+
+def set_tenants(registry: TenantRegistry) -> None:
+    """Replace the registry of tenant clients consulted by `get_client`."""
+    global _tenants
+    _tenants = registry
+
+
+async def _download_media(media_id: str, sha256: str | None = None) -> bytes:
+    return await get_client()._download_media(media_id, sha256=sha256)
+
+
+async def _post_httpx_request(
+    url: str, data: dict | None = None, files: dict | None = None
+) -> dict:
+    return await get_client()._post_httpx_request(url, data=data, files=files)
+
+
+async def send_message(
+    recipient_id: str, message: str, *, phone_number_id: str | None = None, **kwargs
+) -> dict:
+    """Send a text message using the default client. See WhatsAppClient.send_message."""
+    return await get_client(phone_number_id).send_message(
+        recipient_id, message, **kwargs
+    )
+
+
+async def send_quick_reply_message(
+    recipient_id: str,
+    message: str,
+    buttons: list[str],
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send a quick reply message using the default client. See WhatsAppClient.send_quick_reply_message."""
+    return await get_client(phone_number_id).send_quick_reply_message(
+        recipient_id, message, buttons, **kwargs
+    )
+
+
+async def _upload_media(
+    source: MediaSource,
+    file_name: str | None = None,
+    mime_type: str | None = None,
+    **kwargs,
+) -> dict:
+    return await get_client()._upload_media(source, file_name, mime_type, **kwargs)
+
+
+async def upload_media(
+    source: MediaSource,
+    file_name: str | None = None,
+    mime_type: str | None = None,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> str:
+    """Upload a media file once using the default client. See WhatsAppClient.upload_media."""
+    return await get_client(phone_number_id).upload_media(
+        source, file_name, mime_type, **kwargs
+    )
+
+
+async def send_media_by_id(
+    recipient_id: str,
+    media_id: str,
+    media_type: str,
+    *,
+    filename: str | None = None,
+    caption: str | None = None,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send uploaded media using the default client. See WhatsAppClient.send_media_by_id."""
+    return await get_client(phone_number_id).send_media_by_id(
+        recipient_id,
+        media_id,
+        media_type,
+        filename=filename,
+        caption=caption,
+        **kwargs,
+    )
+
+
+async def send_bulk(
+    recipients: Iterable[str],
+    payload: dict,
+    *,
+    concurrency: int = 50,
+    messages_per_second: float = 80,
+    phone_number_id: str | None = None,
+) -> AsyncIterator[BulkResult]:
+    """Send a message to many recipients using the default client. See WhatsAppClient.send_bulk."""
+    async for result in get_client(phone_number_id).send_bulk(
+        recipients,
+        payload,
+        concurrency=concurrency,
+        messages_per_second=messages_per_second,
+    ):
+        yield result
+
+
+async def send_pdf(
+    recipient_id: str,
+    file_data: MediaSource,
+    file_name: str,
+    mime_type: str,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send a PDF file using the default client. See WhatsAppClient.send_pdf."""
+    return await get_client(phone_number_id).send_pdf(
+        recipient_id, file_data, file_name, mime_type, **kwargs
+    )
+
+
+async def send_media(
+    recipient_id: str,
+    source: MediaSource,
+    media_type: str,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Upload and send media using the default client. See WhatsAppClient.send_media."""
+    return await get_client(phone_number_id).send_media(
+        recipient_id, source, media_type, **kwargs
+    )
+
+
+async def send_document(
+    recipient_id: str,
+    source: MediaSource,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send a document using the default client. See WhatsAppClient.send_media."""
+    return await get_client(phone_number_id).send_document(
+        recipient_id, source, **kwargs
+    )
+
+
+async def send_image(
+    recipient_id: str,
+    source: MediaSource,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send an image using the default client. See WhatsAppClient.send_media."""
+    return await get_client(phone_number_id).send_image(recipient_id, source, **kwargs)
+
+
+async def send_audio(
+    recipient_id: str,
+    source: MediaSource,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send an audio file using the default client. See WhatsAppClient.send_media."""
+    return await get_client(phone_number_id).send_audio(recipient_id, source, **kwargs)
+
+
+async def send_video(
+    recipient_id: str,
+    source: MediaSource,
+    *,
+    phone_number_id: str | None = None,
+    **kwargs,
+) -> dict:
+    """Send a video using the default client. See WhatsAppClient.send_media."""
+    return await get_client(phone_number_id).send_video(recipient_id, source, **kwargs)
+
+
+class QueueFullError(Exception):
+    """Raised when an item is enqueued into a WorkQueue or KeyedScheduler at capacity."""
+
+
+class WorkQueue:
+    """
+    A bounded in-process asyncio job queue served by a pool of workers.
+
+    Webhook handlers enqueue the payload and return immediately, while the
+    workers run `handler` for each item in the background. When the queue is
+    full, `enqueue` raises QueueFullError so callers can push back (e.g. reply
+    with 503 and let Meta redeliver later) instead of buffering without bound.
+
+    Args:
+        handler (Callable): Coroutine function called with every enqueued item.
+        workers (int): Number of concurrent worker tasks. Defaults to 8.
+        maxsize (int): Maximum number of items waiting in the queue. Defaults to 1000.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        *,
+        workers: int = 8,
+        maxsize: int = 1000,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def stats(self) -> dict:
+        """Return counters and gauges describing the load on the queue."""
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_depth": self.max_depth,
+            "maxsize": self.maxsize,
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def start(self) -> "WorkQueue":
+        """Start the worker tasks on the running event loop."""
+        if not self.running:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"work-queue-{i}")
+                for i in range(self.workers)
+            ]
+        return self
+
+    def enqueue(self, item: Any) -> None:
+        """
+        Add an item to the queue without waiting.
+
+        Raises:
+            RuntimeError: If the queue has not been started.
+            QueueFullError: If the queue is at capacity.
+        """
+        if self._queue is None or not self.running:
+            raise RuntimeError("The WorkQueue has not been started.")
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logging.warning(
+                f"Work queue is full, rejected item ({self.stats()}).",
+                extra={"category": "queue"},
+            )
+            raise QueueFullError("The work queue is full.")
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def stop(self, timeout: float | None = 30) -> None:
+        """
+        Gracefully shut down: wait for queued items to be processed, then stop the workers.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the queue to drain before
+                cancelling the remaining work. None waits indefinitely.
+        """
+        if not self.running or self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(
+                f"Work queue did not drain within {timeout}s, "
+                f"dropping {self._queue.qsize()} items."
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception("Failed to process queued item.")
+            finally:
+                self._queue.task_done()
+
+
+def conversation_key(event: WamBase | WamStatus) -> tuple[str, str]:
+    """Return the (phone_number_id, wa_id) pair identifying the conversation of an event."""
+    if isinstance(event, WamStatus):
+        return event.phone_number_id, event.recipient_id
+    return event.phone_number_id, event.wa_id
+
+
+class KeyedScheduler:
+    """
+    Runs jobs in submission order per key while different keys run in parallel.
+
+    Keyed by `conversation_key`, two messages of the same user are handled one
+    after the other, so replies go out in order, while a pool of workers serves
+    many conversations at once. Keys with pending jobs take turns: a worker runs
+    one job of a key and then puts the key at the back of the line, so a chatty
+    user cannot starve others. Each key holds at most `max_per_key` pending jobs,
+    and the bookkeeping for keys idle longer than `idle_ttl` is evicted.
+
+    Args:
+        workers (int): Number of concurrent worker tasks. Defaults to 8.
+        max_per_key (int): Maximum pending jobs per key. Defaults to 100.
+        idle_ttl (float): Seconds after which an idle key is forgotten. Defaults to 300.
+    """
+
+    def __init__(
+        self, *, workers: int = 8, max_per_key: int = 100, idle_ttl: float = 300
+    ):
+        self.workers = workers
+        self.max_per_key = max_per_key
+        self.idle_ttl = idle_ttl
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._jobs: dict[Hashable, deque[Callable[[], Awaitable[Any]]]] = {}
+        self._idle_since: dict[Hashable, float] = {}
+        self._scheduled: set[Hashable] = set()
+        self._ready: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._evictor: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def stats(self) -> dict:
+        """Return counters and gauges describing the load on the scheduler."""
+        return {
+            "keys": len(self._jobs),
+            "active_keys": len(self._scheduled),
+            "pending": sum(len(q) for q in self._jobs.values()),
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def start(self) -> "KeyedScheduler":
+        """Start the worker tasks on the running event loop."""
+        if not self.running:
+            self._ready = asyncio.Queue()
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"keyed-scheduler-{i}")
+                for i in range(self.workers)
+            ]
+            self._evictor = asyncio.create_task(self._evict_idle_keys())
+        return self
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Schedule `job` to run after all jobs previously submitted for `key`.
+
+        Raises:
+            RuntimeError: If the scheduler has not been started.
+            QueueFullError: If the key already has `max_per_key` pending jobs.
+        """
+        if self._ready is None or not self.running:
+            raise RuntimeError("The KeyedScheduler has not been started.")
+        jobs = self._jobs.setdefault(key, deque())
+        if len(jobs) >= self.max_per_key:
+            self.rejected += 1
+            raise QueueFullError(f"Too many pending jobs for {key}.")
+        jobs.append(job)
+        self._idle_since.pop(key, None)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+
+    async def stop(self, timeout: float | None = 30) -> None:
+        """
+        Gracefully shut down: wait for pending jobs to finish, then stop the workers.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the jobs before cancelling
+                the remaining work. None waits indefinitely.
+        """
+        if not self.running or self._ready is None:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Keyed scheduler did not drain within {timeout}s.")
+        tasks = [*self._tasks, self._evictor]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._evictor = None
+
+    async def _worker(self) -> None:
+        assert self._ready is not None
+        while True:
+            key = await self._ready.get()
+            jobs = self._jobs[key]
+            job = jobs.popleft()
+            try:
+                await job()
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception(f"Failed to process job for {key}.")
+            finally:
+                if jobs:
+                    # back of the line, other keys get their turn first
+                    self._ready.put_nowait(key)
+                else:
+                    self._scheduled.discard(key)
+                    self._idle_since[key] = time.monotonic()
+                self._ready.task_done()
+
+    async def _evict_idle_keys(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_ttl)
+            cutoff = time.monotonic() - self.idle_ttl
+            for key, idle_since in list(self._idle_since.items()):
+                if idle_since <= cutoff and not self._jobs.get(key):
+                    del self._idle_since[key]
+                    self._jobs.pop(key, None)
+
+
+class StatusSink(ABC):
+    """Interface for destinations of batched status updates."""
+
+    @abstractmethod
+    async def write(self, statuses: list[WamStatus]) -> None:
+        """Persist a batch holding the latest status of each wamid."""
+
+    async def close(self) -> None:
+        """Release resources held by the sink."""
+
+
+class CallbackSink(StatusSink):
+    """Passes each batch to a plain or async callback."""
+
+    def __init__(self, callback: Callable[[list[WamStatus]], Any]):
+        self.callback = callback
+
+    async def write(self, statuses: list[WamStatus]) -> None:
+        result = self.callback(statuses)
+        if inspect.isawaitable(result):
+            await result
+
+
+class JsonlStatusSink(StatusSink):
+    """Appends one JSON line per status to a file."""
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+
+    async def write(self, statuses: list[WamStatus]) -> None:
+        lines = "".join(json.dumps(asdict(s)) + "\n" for s in statuses)
+        await asyncio.to_thread(self._append, lines)
+
+    def _append(self, lines: str) -> None:
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+
+class SqliteStatusSink(StatusSink):
+    """
+    Keeps the latest status per wamid in a SQLite table.
+
+    A status only replaces the stored one if it ranks at least as high, so
+    out-of-order batches cannot move a message back from read to delivered.
+    """
+
+    def __init__(self, path: str | os.PathLike, table: str = "message_statuses"):
+        self.path = str(path)
+        self.table = table
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "wamid TEXT PRIMARY KEY, recipient_id TEXT, phone_number_id TEXT, "
+                "status TEXT, rank INTEGER, timestamp TEXT, conversation_id TEXT, "
+                "pricing_category TEXT, errors TEXT)"
+            )
+        return self._db
+
+    async def write(self, statuses: list[WamStatus]) -> None:
+        await asyncio.to_thread(self._write, statuses)
+
+    def _write(self, statuses: list[WamStatus]) -> None:
+        db = self._connect()
+        with db:
+            db.executemany(
+                f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(wamid) DO UPDATE SET status=excluded.status, "
+                "rank=excluded.rank, timestamp=excluded.timestamp, "
+                "conversation_id=excluded.conversation_id, "
+                "pricing_category=excluded.pricing_category, errors=excluded.errors "
+                f"WHERE excluded.rank >= {self.table}.rank",
+                [
+                    (
+                        s.wamid,
+                        s.recipient_id,
+                        s.phone_number_id,
+                        s.status,
+                        s.rank,
+                        s.timestamp,
+                        s.conversation_id,
+                        s.pricing_category,
+                        json.dumps(s.errors),
+                    )
+                    for s in statuses
+                ],
+            )
+
+    async def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class StatusAggregator:
+    """
+    Coalesces status updates per wamid and flushes them to a sink in batches.
+
+    Statuses outnumber inbound messages several times over, so instead of one
+    write per webhook, updates are collected until `max_batch` wamids are pending
+    or `flush_interval` seconds passed. Only the highest ranking status of each
+    wamid is kept, e.g. a "read" replaces an earlier "delivered".
+
+    Args:
+        sink (StatusSink): Where batches are written.
+        max_batch (int): Pending wamids that trigger a flush. Defaults to 500.
+        flush_interval (float): Seconds between time-based flushes. Defaults to 5.
+    """
+
+    def __init__(
+        self, sink: StatusSink, *, max_batch: int = 500, flush_interval: float = 5
+    ):
+        self.sink = sink
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.received = 0
+        self.written = 0
+        self._pending: dict[str, WamStatus] = {}
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        """The number of wamids waiting for the next flush."""
+        return len(self._pending)
+
+    async def start(self) -> "StatusAggregator":
+        """Start flushing every `flush_interval` seconds."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write what is still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        await self.sink.close()
+
+    async def add(self, status: WamStatus) -> None:
+        """Add a status update, flushing if the batch is full."""
+        self.received += 1
+        current = self._pending.get(status.wamid)
+        if current is None or status.rank >= current.rank:
+            self._pending[status.wamid] = status
+        if len(self._pending) >= self.max_batch:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write all pending statuses to the sink."""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = list(self._pending.values()), {}
+            try:
+                await self.sink.write(batch)
+            except Exception:
+                # keep the batch for the next flush unless newer statuses arrived
+                for status in batch:
+                    self._pending.setdefault(status.wamid, status)
+                raise
+            self.written += len(batch)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Failed to flush status updates.")
+
+
+EventHandler = Callable[[Any], Awaitable[Any]]
+
+
+@dataclass(slots=True)
+class _Route:
+    handler: EventHandler
+    predicate: Callable[[Any], bool] | None
+    timeout: float | None
+
+
+class Router:
+    """
+    Dispatches webhook events to handlers registered with decorators.
+
+    Handlers are indexed by message type (or status) when they are registered,
+    so dispatching an event only looks at the handlers for its type plus the
+    catch-all handlers, no matter how many handlers there are. Regex patterns
+    are compiled once at registration. All handlers matching an event run
+    concurrently, each with its own timeout; a failing or slow handler is logged
+    and does not affect the others.
+
+    Example:
+        router = Router()
+
+        @router.on_text(r"^(hi|hello)")
+        async def greet(wam: WamBase):
+            await send_message(wam.wa_id, "Hi there!")
+
+    Args:
+        default_timeout (float, optional): Seconds a handler may run unless given
+            otherwise when registered. None disables the timeout. Defaults to 30.
+    """
+
+    _ANY_MESSAGE = "*"
+    _ANY_STATUS = "status:*"
+
+    def __init__(self, *, default_timeout: float | None = 30):
+        self.default_timeout = default_timeout
+        self._index: dict[str, list[_Route]] = defaultdict(list)
+        self._resolved: dict[tuple[str, str], list[_Route]] = {}
+
+    def _add(
+        self,
+        keys: Iterable[str],
+        predicate: Callable[[Any], bool] | None,
+        timeout: float | None | Literal["default"],
+    ) -> Callable[[EventHandler], EventHandler]:
+        def decorator(handler: EventHandler) -> EventHandler:
+            route = _Route(
+                handler,
+                predicate,
+                self.default_timeout if timeout == "default" else timeout,
+            )
+            for key in keys:
+                self._index[key].append(route)
+            self._resolved.clear()
+            return handler
+
+        return decorator
+
+    def on(
+        self,
+        *message_types: str,
+        predicate: Callable[[Any], bool] | None = None,
+        timeout: float | None | Literal["default"] = "default",
+    ) -> Callable[[EventHandler], EventHandler]:
+        """
+        Register a handler for messages of the given types, or of any type if none
+        are given, optionally filtered by `predicate`.
+        """
+        return self._add(message_types or [self._ANY_MESSAGE], predicate, timeout)
+
+    def on_text(
+        self,
+        pattern: str | re.Pattern | None = None,
+        *,
+        predicate: Callable[[Any], bool] | None = None,
+        timeout: float | None | Literal["default"] = "default",
+    ) -> Callable[[EventHandler], EventHandler]:
+        """Register a handler for text messages, optionally matching a regex."""
+        if pattern is not None:
+            regex = re.compile(pattern)
+            extra = predicate
+
+            def matches(wam: WamBase) -> bool:
+                return regex.search(wam.message_body) is not None and (
+                    extra is None or extra(wam)
+                )
+
+            predicate = matches
+        return self.on("text", predicate=predicate, timeout=timeout)
+
+    def on_media(
+        self,
+        *media_types: str,
+        predicate: Callable[[Any], bool] | None = None,
+        timeout: float | None | Literal["default"] = "default",
+    ) -> Callable[[EventHandler], EventHandler]:
+        """Register a handler for media messages of the given types, or of any media type."""
+        return self.on(
+            *(media_types or MEDIA_TYPES), predicate=predicate, timeout=timeout
+        )
+
+    def on_status(
+        self,
+        *statuses: str,
+        predicate: Callable[[Any], bool] | None = None,
+        timeout: float | None | Literal["default"] = "default",
+    ) -> Callable[[EventHandler], EventHandler]:
+        """Register a handler for status updates with the given statuses, or all of them."""
+        keys = [f"status:{s}" for s in statuses] or [self._ANY_STATUS]
+        return self._add(keys, predicate, timeout)
+
+    def routes_for(self, event: WamBase | WamStatus) -> list[_Route]:
+        """Return the routes indexed for the event's type, before predicates."""
+        if isinstance(event, WamStatus):
+            key = (f"status:{event.status}", self._ANY_STATUS)
+        else:
+            key = (event.message_type, self._ANY_MESSAGE)
+        routes = self._resolved.get(key)
+        if routes is None:
+            routes = self._resolved[key] = self._index.get(
+                key[0], []
+            ) + self._index.get(key[1], [])
+        return routes
+
+    async def dispatch(self, event: WamBase | WamStatus) -> int:
+        """
+        Run all handlers matching the event concurrently.
+
+        Returns:
+            int: The number of handlers that completed successfully.
+        """
+        routes = [
+            r
+            for r in self.routes_for(event)
+            if r.predicate is None or r.predicate(event)
+        ]
+        if not routes:
+            return 0
+        results = await asyncio.gather(
+            *(asyncio.wait_for(r.handler(event), r.timeout) for r in routes),
+            return_exceptions=True,
+        )
+        for route, result in zip(routes, results):
+            if _metrics.enabled:
+                outcome = "ok"
+                if isinstance(result, asyncio.TimeoutError):
+                    outcome = "timeout"
+                elif isinstance(result, BaseException):
+                    outcome = "error"
+                _metrics.inc(
+                    "whatsapp_handler_total",
+                    handler=route.handler.__name__,
+                    outcome=outcome,
+                )
+            if isinstance(result, asyncio.TimeoutError):
+                logging.error(
+                    f"Handler {route.handler.__name__} timed out after "
+                    f"{route.timeout}s on {event.wamid}"
+                )
+            elif isinstance(result, Exception):
+                logging.error(
+                    f"Handler {route.handler.__name__} failed on {event.wamid}",
+                    exc_info=result,
+                )
+        return sum(not isinstance(r, BaseException) for r in results)
+
+
+@dataclass(slots=True)
+class OutboxMessage:
+    """A message claimed from the outbox for sending."""
+
+    idempotency_id: str
+    data: dict
+    attempts: int
+
+
+class OutboxBackend(ABC):
+    """
+    Interface for durable queues of outbound messages.
+
+    Messages are claimed with a lease: a claimed message that is neither completed
+    nor failed before the lease expires (e.g. because the process crashed) is
+    handed out again, which gives at-least-once delivery.
+    """
+
+    @abstractmethod
+    async def put(self, idempotency_id: str, data: dict) -> bool:
+        """
+        Store a message unless one with the same idempotency_id exists.
+
+        Returns:
+            bool: True if the message was added, False for a duplicate.
+        """
+
+    @abstractmethod
+    async def claim(self, limit: int, lease: float) -> list[OutboxMessage]:
+        """Claim up to `limit` due messages for `lease` seconds, oldest first."""
+
+    @abstractmethod
+    async def complete(self, idempotency_id: str, response: dict) -> None:
+        """Mark a claimed message as sent."""
+
+    @abstractmethod
+    async def fail(
+        self, idempotency_id: str, error: str, retry_at: float | None
+    ) -> None:
+        """Release a claimed message for a retry at `retry_at`, or give up if None."""
+
+    async def close(self) -> None:
+        """Release resources held by the backend."""
+
+
+class SqliteOutbox(OutboxBackend):
+    """
+    An OutboxBackend in a SQLite database in WAL mode.
+
+    Args:
+        path (str | os.PathLike): The database file. Created if missing.
+        table (str): The table name. Defaults to "outbox".
+    """
+
+    def __init__(self, path: str | os.PathLike, table: str = "outbox"):
+        self.path = str(path)
+        self.table = table
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "idempotency_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "state TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, "
+                "created_at REAL NOT NULL, response TEXT, error TEXT)"
+            )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_due "
+                f"ON {self.table} (state, available_at)"
+            )
+        return self._db
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        def locked():
+            with self._lock:
+                db = self._connect()
+                with db:
+                    return fn(db, *args)
+
+        return await asyncio.to_thread(locked)
+
+    async def put(self, idempotency_id: str, data: dict) -> bool:
+        def put(db: sqlite3.Connection) -> bool:
+            now = time.time()
+            cursor = db.execute(
+                f"INSERT OR IGNORE INTO {self.table} "
+                "(idempotency_id, data, available_at, created_at) VALUES (?, ?, ?, ?)",
+                (idempotency_id, json.dumps(data), now, now),
+            )
+            return cursor.rowcount == 1
+
+        return await self._run(put)
+
+    async def claim(self, limit: int, lease: float) -> list[OutboxMessage]:
+        def claim(db: sqlite3.Connection) -> list[OutboxMessage]:
+            now = time.time()
+            # expired leases of in-flight messages are claimed again after a crash
+            rows = db.execute(
+                f"SELECT idempotency_id, data, attempts FROM {self.table} "
+                "WHERE state IN ('pending', 'inflight') AND available_at <= ? "
+                "ORDER BY created_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            db.executemany(
+                f"UPDATE {self.table} SET state = 'inflight', available_at = ?, "
+                "attempts = attempts + 1 WHERE idempotency_id = ?",
+                [(now + lease, row[0]) for row in rows],
+            )
+            return [
+                OutboxMessage(idempotency_id, json.loads(data), attempts + 1)
+                for idempotency_id, data, attempts in rows
+            ]
+
+        return await self._run(claim)
+
+    async def complete(self, idempotency_id: str, response: dict) -> None:
+        await self._run(
+            lambda db: db.execute(
+                f"UPDATE {self.table} SET state = 'sent', response = ? "
+                "WHERE idempotency_id = ?",
+                (json.dumps(response), idempotency_id),
+            )
+        )
+
+    async def fail(
+        self, idempotency_id: str, error: str, retry_at: float | None
+    ) -> None:
+        state = "pending" if retry_at is not None else "dead"
+        await self._run(
+            lambda db: db.execute(
+                f"UPDATE {self.table} SET state = ?, error = ?, available_at = ? "
+                "WHERE idempotency_id = ?",
+                (state, error, retry_at or 0, idempotency_id),
+            )
+        )
+
+    async def counts(self) -> dict[str, int]:
+        """Return the number of messages per state."""
+        rows = await self._run(
+            lambda db: db.execute(
+                f"SELECT state, COUNT(*) FROM {self.table} GROUP BY state"
+            ).fetchall()
+        )
+        return dict(rows)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class OutboxDispatcher:
+    """
+    Drains an outbox through a WhatsAppClient.
+
+    Due messages are claimed in batches, sent concurrently at no more than
+    `messages_per_second`, and marked as sent. Failures are retried with
+    exponential backoff, while the circuit breaker is open the batch is deferred
+    until it closes, and messages the API rejects (4xx other than throttling) or
+    that failed `max_attempts` times are given up on. Because messages are only
+    marked as sent after the API accepted them, a restart resumes where the
+    previous process stopped, at the cost of possibly sending a message twice if
+    the process died between sending and marking it.
+
+    Args:
+        client (WhatsAppClient): The client sending the messages.
+        outbox (OutboxBackend): The outbox to drain. Defaults to `client.outbox`.
+        batch_size (int): Messages claimed at once. Defaults to 50.
+        messages_per_second (float): Maximum send rate. Defaults to 80.
+        poll_interval (float): Seconds to wait when the outbox is empty.
+        lease (float): Seconds a claimed message is reserved for this dispatcher.
+        max_attempts (int): Attempts before a message is given up on.
+    """
+
+    def __init__(
+        self,
+        client: WhatsAppClient,
+        outbox: OutboxBackend | None = None,
+        *,
+        batch_size: int = 50,
+        messages_per_second: float = 80,
+        poll_interval: float = 0.5,
+        lease: float = 60,
+        max_attempts: int = 10,
+    ):
+        outbox = outbox or client.outbox
+        if outbox is None:
+            raise ValueError("No outbox given and the client has none.")
+        self.client = client
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.limiter = TokenBucket(messages_per_second)
+        self.sent = 0
+        self.failed = 0
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    async def start(self) -> "OutboxDispatcher":
+        """Start draining the outbox in the background."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        """Finish the current batch and stop. Unsent messages stay in the outbox."""
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def drain_once(self) -> int:
+        """
+        Claim and send one batch of due messages.
+
+        Returns:
+            int: The number of messages claimed.
+        """
+        batch = await self.outbox.claim(self.batch_size, self.lease)
+        await asyncio.gather(*(self._send(m) for m in batch))
+        return len(batch)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                claimed = await self.drain_once()
+            except Exception:
+                logging.exception("Failed to drain the outbox.")
+                claimed = 0
+            if not claimed:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _send(self, message: OutboxMessage) -> None:
+        await self.limiter.acquire()
+        try:
+            r = await self.client._post_httpx_request(
+                self.client.messages_url, data=message.data
+            )
+        except CircuitOpenError as e:
+            await self.outbox.fail(
+                message.idempotency_id, str(e), time.time() + e.retry_after
+            )
+            return
+        except Exception as e:
+            self.failed += 1
+            retry_at = time.time() + min(300, 2**message.attempts)
+            rejected = (
+                isinstance(e, httpx.HTTPStatusError)
+                and e.response.is_client_error
+                and not self.client.retry_policy.is_throttled(e.response)
+            )
+            if rejected or message.attempts >= self.max_attempts:
+                logging.error(f"Giving up on outbox message {message.idempotency_id}.")
+                retry_at = None
+            await self.outbox.fail(message.idempotency_id, repr(e), retry_at)
+            return
+        await self.outbox.complete(message.idempotency_id, r)
+        self.sent += 1
@@ -0,0 +1,14 @@
+"""
+Pydantic models of the webhook payload.
+
+whatsapp.py imports this module lazily: building the models takes longer than
+importing the rest of the library, and only the pydantic-based parsing helpers
+need them.
+"""
+
+from pydantic import BaseModel
+
+
+class WebhookRequestData(BaseModel):
+    object: str = ""
+    entry: list = []